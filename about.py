@@ -4,6 +4,8 @@ gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk, GLib
 
 from dflib import widgets, rest, psen
+from sensorhub import SensorHub
+from iconimages import get_icon_cache
 from dflib.debug import debug
 
 class AboutDialog(widgets.AboutDialog):
@@ -26,21 +28,28 @@ class AboutDialog(widgets.AboutDialog):
 		self._macos = True if 'Darwin' in os.uname()[0] else False
 
 		if position:
-			if '::main::' in position:
-				position = list(self.config['sensors']['::main::']['pos'])
-				for i in range(0,2):
-					position[i] = position[i] + 25
-				self.move(*position)
+			# open just below and right of the window it came from
+			position = list(position)
+			for i in range(0,2):
+				position[i] = position[i] + 25
+			self.move(*position)
 		self.connect('configure-event',self.on_window_config)
 		self.connect("delete-event", self.stopit)
 		self.set_about_text()
 	
 	def get_markup(self):
+		hub = SensorHub.get()
+		icons = get_icon_cache().stats
 		stats = f"""
 
+		Hub: Sensors   {hub.sensor_count()}
+		Hub: Listeners {hub.listener_count()}
+		Hub: Published {hub.stats['published']}
 		PSen Reads   {psen.stats['reads']}
 		Rest: Sent   {rest.stats['sent']}
 		Rest: Errors {rest.stats['errors']}
+		Icons: Decoded {icons['decoded']}
+		Icons: Hits    {icons['hits']}
 		
 		"""
 		return f"""
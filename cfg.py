@@ -1,14 +1,137 @@
+'''
+The program's configuration, kept in two files:
+    sensors.json - what to read: the server, the poll interval and for each
+        sensor its host, sensor and icon. This is all the collector loads.
+    session.json - how the GUI was left: where windows are and which are
+        open, chart settings, dark mode.
+get_config() merges both into one dict, so config['sensors'][name]['pos']
+and the like work as they always have, and the config is split again when
+it is saved. The accessor classes give typed access to the same dict.
+
+The files are saved on their own cadence. Definitions change when a sensor
+is edited and are written straight away. Session state changes whenever a
+window moves, so it is written once things have been quiet for write_delay
+seconds. Writes are atomic and skipped when nothing has changed. flush()
+writes anything pending now; it is also called at exit.
+
+A sensors.json from before the split, with the UI state in it and the
+main and about windows as '::main::' and '::about::' sensors, is split
+when it is loaded and the original kept as sensors.json.legacy.
+'''
 import os
+import copy
 import json
-import tempfile
+import atexit
+from gi.repository import GLib
+from dflib.snapshot import write_atomic
+
+definitions_file = 'sensors.json'
+session_file = 'session.json'
+write_delay = 0.5
+
+# what goes in the definitions file, everything else is session state
+definition_settings = ['server', 'poll_interval', 'history_db']
+definition_keys = ['host', 'sensor', 'icon']
+
+default_windows = {
+    'main': {'active': True, 'pos': [0, 25], 'size': [900, 450]},
+    'about': {'active': False, 'pos': [25, 50]},
+}
 
 config = None
+_timeout = None
+_written = {}
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def split(merged):
+    ''' split a merged config into (definitions, session) '''
+    definitions = {k: v for k, v in merged.items() if k in definition_settings}
+    session = {k: v for k, v in merged.items() if not k in definition_settings and k != 'sensors'}
+    definitions['sensors'] = {}
+    session['sensors'] = {}
+    for name, sensor in merged.get('sensors', {}).items():
+        definitions['sensors'][name] = {k: v for k, v in sensor.items() if k in definition_keys}
+        session['sensors'][name] = {k: v for k, v in sensor.items() if not k in definition_keys}
+    return definitions, session
+
+def merge(definitions, session):
+    ''' one config dict from definitions and session state '''
+    merged = {k: v for k, v in session.items() if k != 'sensors'}
+    merged.update({k: v for k, v in definitions.items() if k != 'sensors'})
+    windows = merged.setdefault('windows', {})
+    for name, state in default_windows.items():
+        windows.setdefault(name, dict(state))
+    states = session.get('sensors', {})
+    merged['sensors'] = {}
+    for name, definition in definitions.get('sensors', {}).items():
+        sensor = dict(states.get(name, {}))
+        sensor.setdefault('pos', [0, 0])
+        sensor.setdefault('active', False)
+        sensor.update(definition)
+        merged['sensors'][name] = sensor
+    return merged
+
+def _migrate(legacy):
+    '''
+    turn a sensors.json with UI state in it into a merged config, the
+    pseudo sensors become windows
+    '''
+    legacy = dict(legacy)
+    sensors = dict(legacy.get('sensors', {}))
+    windows = legacy.setdefault('windows', {})
+    for name in list(sensors):
+        if name.startswith('::'):
+            windows[name.strip(':')] = sensors.pop(name)
+    # some old files have stray copies at the top level too
+    for name in [k for k in legacy if k.startswith('::')]:
+        windows.setdefault(name.strip(':'), legacy.pop(name))
+    legacy['sensors'] = sensors
+    return legacy
+
+def _merge_session(base, newer):
+    ''' session state from base with newer laid over it, sensor by sensor '''
+    merged = dict(base)
+    for k, v in newer.items():
+        if k in ('sensors', 'windows') and isinstance(merged.get(k), dict):
+            merged[k] = dict(merged[k])
+            for name, state in v.items():
+                merged[k][name] = {**merged[k].get(name, {}), **state}
+        else:
+            merged[k] = v
+    return merged
+
+def _is_legacy(definitions):
+    if any(not k in definition_settings and k != 'sensors' for k in definitions):
+        return True
+    return any(not k in definition_keys
+        for sensor in definitions.get('sensors', {}).values() for k in sensor)
 
 def get_config():
     global config
     if not config:
-        with open('sensors.json') as f:
-            config= json.load(f)
+        definitions = _load(definitions_file)
+        if _is_legacy(definitions):
+            with open(definitions_file, 'rb') as f:
+                write_atomic(definitions_file + '.legacy', f.read())
+            legacy = _migrate(definitions)
+            definitions, session = split(legacy)
+            if os.path.exists(session_file):
+                # keep what the old file had, session.json wins over it
+                session = _merge_session(session, _load(session_file))
+            config = merge(definitions, session)
+            flush(force=True)
+        else:
+            session = _load(session_file)
+            config = merge(definitions, session)
+            # what is on disk already needs no write
+            _written[definitions_file] = copy.deepcopy(definitions)
+            _written[session_file] = copy.deepcopy(session)
     return config
 
 def get_sensors():
@@ -20,7 +143,95 @@ def get_sensor(name):
 def get_sensor_chart(name):
     return get_config()['sensors'][name]['chart']
 
-def write_config():
-    with open('sensors.json','w') as f:
-        json.dump(get_config(),f,indent=4)
+class _Accessor:
+    ''' typed view of a dict in the config '''
+    def __init__(self, data):
+        self.data = data
+
+def _field(key, default=None, kind=None):
+    def get(self):
+        value = self.data.get(key, default)
+        return kind(value) if kind and value is not None else value
+    def set(self, value):
+        self.data[key] = list(value) if kind is tuple else value
+    return property(get, set)
+
+class WindowState(_Accessor):
+    ''' where a window is and whether it is open '''
+    pos = _field('pos', (0, 0), tuple)
+    size = _field('size', None, tuple)
+    active = _field('active', False, bool)
+
+class SensorDefinition(_Accessor):
+    ''' what a sensor is '''
+    host = _field('host')
+    sensor = _field('sensor')
+    icon = _field('icon')
+
+class SensorState(WindowState):
+    ''' the detail window of a sensor, and its chart settings '''
+    chart = _field('chart', None)
+
+def window_state(name):
+    ''' WindowState of a program window, 'main' or 'about' '''
+    windows = get_config()['windows']
+    return WindowState(windows.setdefault(name, dict(default_windows.get(name, {}))))
+
+def sensor_definition(name):
+    return SensorDefinition(get_sensor(name))
+
+def sensor_state(name):
+    return SensorState(get_sensor(name))
+
+def save_definitions():
+    ''' write the definitions now if they have changed '''
+    if config is not None:
+        _write(definitions_file, split(config)[0])
+
+def save_session(now=False):
+    '''
+    write the session state, write_delay seconds after the last call or
+    straight away if now is True
+    '''
+    global _timeout
+    if now:
+        flush()
+        return
+    if _timeout:
+        GLib.source_remove(_timeout)
+    _timeout = GLib.timeout_add(int(write_delay*1000), _on_timeout)
+
+def write_config(now=False):
+    '''
+    save everything: definitions now, session state on its timer. For
+    when sensors or settings are edited; window moves and the like only
+    need save_session().
+    '''
+    save_definitions()
+    save_session(now)
+
+def _on_timeout():
+    global _timeout
+    _timeout = None
+    flush()
+    return False
+
+def _write(path, data, force=False):
+    if not force and data == _written.get(path) and os.path.exists(path):
+        return
+    write_atomic(path, json.dumps(data, indent=4).encode('utf-8'))
+    _written[path] = copy.deepcopy(data)
+
+def flush(force=False):
+    ''' write both files now if they have changed '''
+    global _timeout
+    if _timeout:
+        GLib.source_remove(_timeout)
+        _timeout = None
+    if config is None:
+        return
+    definitions, session = split(config)
+    _write(definitions_file, definitions, force)
+    _write(session_file, session, force)
 
+atexit.register(flush)
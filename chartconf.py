@@ -51,6 +51,8 @@ class ChartConfigPane(Gtk.Box):
 		on_complete: callback to hand off button clicked and new data
 		sensor_type: type  of sensor (aht10, bmp280, etc.)
 		sensor_name: name of the sensor as shown in the iconwindow.
+		sensors: the config's sensors, if given more series from these can
+			be added to the chart
 
 	After this class is instantiated  the config_pane property is availble to be 
 	embedded in layout or toplevel. 
@@ -60,10 +62,11 @@ class ChartConfigPane(Gtk.Box):
 		self.on_complete = None
 		self.sensor_type = None
 		self.sensor_name = None
+		self.sensors = None
 		self.color_buttons = {}
 		Gtk.Box.__init__(self, orientation=Gtk.Orientation.VERTICAL)
 		for k,v in kwargs.items():
-			if k in ['key','on_complete','sensor_type', 'sensor_name']:
+			if k in ['key','on_complete','sensor_type', 'sensor_name', 'sensors']:
 				setattr(self,k,v)
 			else:
 				raise AttributeError(f'{k} is not a valid keyword argument')
@@ -200,6 +203,10 @@ class ChartConfigPane(Gtk.Box):
 		self.range_set.pack_start(self.max_entry,True,True,0)
 
 		rbox.pack_start(self.range_set,True,True,0)
+		self.autoscale_check = Gtk.CheckButton(label='Autoscale')
+		self.autoscale_check.set_active(self.cobj.get('autoscale',False))
+		self.autoscale_check.set_tooltip_text('fit the range to the data instead of using min and max')
+		rbox.pack_start(self.autoscale_check,True,True,0)
 		cbox_outer = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
 		cbox_outer.pack_start(Gtk.Label(label='Colors'),True,True,0)
 		cbox_outer.pack_start(
@@ -255,9 +262,66 @@ class ChartConfigPane(Gtk.Box):
 		ubox.pack_start(self.udigits,True,True,0)
 		box.pack_start(keybox,True,True,0)
 		box.pack_start(ubox,True,True,0)
+		if self.sensors:
+			box.pack_start(self.get_series_box(),True,True,0)
 		box.pack_start(bbox,True,True,0)
 		return box
 
+	def _sensor_keys(self,name):
+		''' the values sensor name can chart '''
+		return list(sencaps.SensorCapabilities(self.sensors[name]['sensor']).get_cap()['ranges'].keys())
+
+	def get_series_box(self):
+		'''
+		controls for the other series charted in the same window, as
+		(sensor name, value) rows that can be added and removed
+		'''
+		box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+		box.pack_start(Gtk.Label(label='More series'),True,True,0)
+		self.series_store = Gtk.ListStore(str,str)
+		for name, key in self.cobj.get('bindings',[])[1:]:
+			self.series_store.append([name,key])
+		self.series_view = Gtk.TreeView(model=self.series_store)
+		for i, title in enumerate(['Sensor','Value']):
+			self.series_view.append_column(Gtk.TreeViewColumn(title,Gtk.CellRendererText(),text=i))
+		self.series_view.set_tooltip_text('other values charted in this window')
+		box.pack_start(self.series_view,True,True,0)
+		names = list(self.sensors.keys())
+		self.series_key = widgets.SimpleCombo(self._sensor_keys(names[0]),selected=self._sensor_keys(names[0])[0])
+		self.series_sensor = widgets.SimpleCombo(names,selected=names[0],on_change=self.on_series_sensor)
+		add_button = Gtk.Button(label='Add')
+		add_button.connect('clicked',self.on_series_add)
+		remove_button = Gtk.Button(label='Remove')
+		remove_button.connect('clicked',self.on_series_remove)
+		abox = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+		abox.pack_start(self.series_sensor,True,True,0)
+		abox.pack_start(self.series_key,True,True,0)
+		abox.pack_start(add_button,True,True,0)
+		abox.pack_start(remove_button,True,True,0)
+		box.pack_start(abox,True,True,0)
+		return box
+
+	def on_series_sensor(self,name):
+		''' offer the values of the newly selected sensor '''
+		keys = self._sensor_keys(name)
+		self.series_key.set_value(keys[0],keys)
+
+	def on_series_add(self,*args):
+		name = self.series_sensor.get_value()
+		key = self.series_key.get_value()
+		if not name or not key:
+			return
+		if name == self.sensor_name and key == self.keysel.get_text():
+			return
+		if any(row[0] == name and row[1] == key for row in self.series_store):
+			return
+		self.series_store.append([name,key])
+
+	def on_series_remove(self,*args):
+		model, iter = self.series_view.get_selection().get_selected()
+		if iter is not None:
+			model.remove(iter)
+
 	def on_key_select(self,key):
 		'''
 		when a new key is used we have to adjust the ranges, so we get them 
@@ -310,6 +374,13 @@ class ChartConfigPane(Gtk.Box):
 			self.cobj['units'][self.key]['digits'] = udig
 			self.cobj['min_value'] = mv
 			self.cobj['max_value'] = xv
+			self.cobj['autoscale'] = self.autoscale_check.get_active()
+			if self.sensors:
+				extra = [[row[0],row[1]] for row in self.series_store]
+				if extra:
+					self.cobj['bindings'] = [[self.sensor_name,self.key]] + extra
+				else:
+					self.cobj.pop('bindings',None)
 
 		self.on_complete(action,self.sensor_name, self.key, self.cobj)
 		#
@@ -376,13 +447,14 @@ class ChartConfig(Gtk.Window, ChartConfigPane):
 		on_complete: callback to hand off button clicked and new data
 		sensor_type: type  of sensor (aht10, bmp280, etc.)
 		sensor_name: name of the sensor as shown in the iconwindow.
+		sensors: the config's sensors, to add more series from
 
 	After this class is instantiated an object with all the properties
 	of Gtk.Window and ChartConfigPane are available.
 	'''
 	def __init__(self,cobj, **kwargs):
 		for k,v in kwargs.items():
-			if k in ['key','on_complete','sensor_type', 'sensor_name']:
+			if k in ['key','on_complete','sensor_type', 'sensor_name', 'sensors']:
 				setattr(self,k,v)
 			else:
 				raise AttributeError(f'{k} is not a valid keyword argument')
@@ -398,7 +470,7 @@ class ChartConfig(Gtk.Window, ChartConfigPane):
 		self.show_all()
 
 if __name__ == "__main__":
-	import json
+	import cfg
 	from dflib.theme import change_theme
 	from dflib.debug import set_debug
 
@@ -408,8 +480,7 @@ if __name__ == "__main__":
 
 	set_debug(True)
 	change_theme(True)
-	with open('sensors.json') as f:
-		cobj = json.load(f)
+	cobj = cfg.get_config()
 	stype = 'aht10'
 	name = 'Sensor - aht(1)'
 	cobj = cobj['sensors'][name]['chart']
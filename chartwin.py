@@ -1,10 +1,11 @@
 import argparse
 import sys
 import os
-import json
 import psutil
 import gi
 import time
+import math
+import statistics
 import matplotlib.colors as mpcolors
 import pprint
 
@@ -16,15 +17,19 @@ sys.path.append(os.path.expanduser('~/lib'))
 sys.path.append(prog_dir)
 os.chdir(prog_dir)
 
+import cfg
 import defaults
 import chartconf
-import boundlist
 import sencaps
-from dflib import widgets, rest, psen
+import history
+from dflib import widgets, rest
 from dflib.LiveChart import LiveChart
+from dflib.ringbuffer import RingBuffer
 from dflib.theme import change_theme
 from dflib.debug import debug, set_debug, dpprint
 from sendetail import SenDetail
+from sensorhub import SensorHub
+from dflib.bgio import get_bgio
 from about import AboutDialog
 from config import SensorsConfig
 from iconbox import IconWindow
@@ -48,7 +53,46 @@ def get_units_information(sen, key):
 	return {key: {'text': '',
 		 	'digits': 4}},'generated'
 
+# readings kept for each series
+chart_samples = 50
+
+def new_buffer():
+	return RingBuffer(chart_samples,timestamps=True)
+
+def history_samples(tier,rows):
+	'''
+	values and times to chart for history rows of (time, avg, min, max).
+	A rollup row gives its min and max, a quarter of its span either side
+	of its middle, so the chart still shows the spikes within it.
+	'''
+	values = []
+	times = []
+	spread = tier['resolution'] / 4 if tier else 0
+	for t, avg, low, high in rows:
+		if not spread or low == high:
+			values.append(avg)
+			times.append(t)
+		else:
+			values += [low,high]
+			times += [t - spread,t + spread]
+	return values, times
+
+def reading_time(reading):
+	''' when reading was taken, now if it does not say '''
+	t = reading.get('time')
+	if type(t) in (int,float):
+		return float(t)
+	return time.time()
+
+# line colors for series after the first
+series_colors = ['#ff8000', '#00c000', '#ff00ff', '#00c0c0', '#ffff00']
+
 class ChartWindow(Gtk.Window):
+	'''
+	Chart key of sensor name. bindings, a list of (sensor name, key),
+	charts several in one window, the first is the window's own name and
+	key.
+	'''
 	def __init__(self, config, **kwargs):
 		# your initialization code remains the same
 		self.keepging = True
@@ -71,11 +115,20 @@ class ChartWindow(Gtk.Window):
 		self.chartdef_backup = None
 		self.color_buttons = {}
 		self.size = (0,0)
-		self.update_timeout = None
+		self.hub_tokens = []
+		self.reading = None
+		self.readings = {}
+		self.bindings = kwargs.get('bindings')
+		self.series = []
+		self.sample_timeout = None
+		self.last_sample = 0
 		self.config_window = None
 		self.units = None
 		self.min_value = -1
+		self.autoscale = False
 		self.max_value = -1
+		if self.bindings:
+			self.name, self.key = self.bindings[0]
 		if not self.name:
 			raise AttributeError('name must be supplied')
 
@@ -92,25 +145,25 @@ class ChartWindow(Gtk.Window):
 		else:
 			self.chart_obj = defaults.chart
 
-		self.sensor = psen.PsuedoSensor(
-			base_path = self.data_path,
-			server='Some Server',
-			host=self.host,
-			sensor=self.sen)
-
 		self.sencap = sencaps.SensorCapabilities(self.sen).get_cap()
 		self.kavail = list(self.sencap['units'].keys())
 
 		Gtk.Window.__init__(self,title=self.name,icon=self.window_icon)
 		self.connect('destroy',self.stopit)
-		self.data = boundlist.BoundList(30)
+		self.data = new_buffer()
 		self.background_color = '#000000'
 		self.legend_color = '#ffffff'
 		self.line_color = '#0000ff'
 		self.paused = False
+		self.drag = None
+		self.fetch_timeout = None
+		self.fetch_generation = 0
 
+		bindings = self.bindings
 		for k,v in self.chart_obj.items():
 			setattr(self,k,v)
+		if bindings:
+			self.bindings = bindings
 
 		if self.units:
 			if not self.key in self.units:
@@ -140,10 +193,15 @@ class ChartWindow(Gtk.Window):
 			line_width=self.line_width,
 			min_value=self.min_value,
 			max_value=self.max_value,
-			relative_scale=False)
+			relative_scale=self.autoscale,
+			scrolling=True,
+			capacity=chart_samples,
+			time_window=self.time_window(),
+			gap=self.gap())
+		self.add_bindings(self.bindings[1:] if self.bindings else [])
 
 
-		self.data = boundlist.BoundList(50)
+		self.data = new_buffer()
 		grid = Gtk.Grid()
 		self.add(grid)
 
@@ -182,6 +240,7 @@ class ChartWindow(Gtk.Window):
 
 		# Attach the chart to the grid
 		grid.attach(self.chart, 0, 2, 1, 2)
+		self.connect_browsing()
 
 		# Set chart data and other configurations
 		if 'chart' in self.config['sensors'][self.name]:
@@ -193,18 +252,114 @@ class ChartWindow(Gtk.Window):
 
 		if self.interval <= 100:
 			self.interval = 100;
-		self.data.append(self.sensor.read()[self.key])
+		self.reset_timer()
+		self.reading = SensorHub.get().last(self.host,self.sen)
+		if self.reading and self.key in self.reading:
+			self.data.append(self.reading[self.key],reading_time(self.reading))
 		self.chart.set_data(self.data)
+		self.backfill()
 		self.set_title_status()
 		self.update()
 		self.show_all()
-		self._trigger()
 		self.connect('destroy', self.stopit)
 		self.connect('configure-event', self.on_configure)
 		self.set_resizable(False)
 		GLib.timeout_add(100, self._set_initialized)
 		self.reconfig(self.key,self.chart_obj	)
-		self.reset_timer()
+
+	def add_bindings(self,bindings):
+		'''
+		chart more (sensor name, key) pairs in this window, each as another
+		series on the chart with its own color and scale
+		'''
+		for i, (name, key) in enumerate(bindings):
+			if not name in self.config['sensors']:
+				debug(f'no sensor {name}, not charting {key}')
+				continue
+			sdef = self.config['sensors'][name]
+			try:
+				low, high = sencaps.SensorCapabilities(sdef['sensor']).get_cap()['ranges'][key]
+			except Exception as e:
+				debug(f'no range for {name}:{key}: {e}')
+				low, high = self.min_value, self.max_value
+			binding = {
+				'name': name,
+				'key': key,
+				'host': sdef['host'],
+				'sen': sdef['sensor'],
+				'data': new_buffer()
+			}
+			self.chart.add_series(
+				name=f'{name} {key}',
+				line_color=series_colors[i % len(series_colors)],
+				min_value=low,
+				max_value=high,
+				data=binding['data'])
+			self.series.append(binding)
+		if self.series:
+			self.chart.series[0].name = f'{self.name} {self.key}'
+
+	def set_bindings(self,bindings):
+		'''
+		chart bindings, as for the constructor, instead of the current ones.
+		Nothing is done if the extra series are the same.
+		'''
+		extra = [list(b) for b in (bindings or [])[1:]]
+		if extra == [[b['name'],b['key']] for b in self.series]:
+			return
+		for index in range(len(self.chart.series) - 1,0,-1):
+			self.chart.remove_series(index)
+		self.series = []
+		self.add_bindings(extra)
+		self.bindings = [[self.name,self.key]] + extra if extra else None
+		if self.hub_tokens:
+			self.reset_timer()
+		self.backfill()
+
+	def backfill(self):
+		'''
+		fill the chart from the history database in the background
+		'''
+		path = self.config.get('history_db','history.db')
+		if not os.path.exists(path):
+			return
+		wanted = [(0,self.host,self.sen,self.key)]
+		wanted += [(i+1,b['host'],b['sen'],b['key']) for i, b in enumerate(self.series)]
+		for index, host, sen, key in wanted:
+			get_bgio().submit(
+				lambda host=host,sen=sen,key=key: history.open_history(path).recent(host,sen,key,50),
+				callback=lambda rows, index=index, source=(host,sen,key): self.on_backfill(index,source,rows),
+				owner=self)
+
+	def on_backfill(self,index,source,rows):
+		''' put history samples ahead of the ones we have taken '''
+		if not rows:
+			return
+		# the series may have changed while history was read
+		if index == 0:
+			current = (self.host,self.sen,self.key)
+		elif index <= len(self.series):
+			series = self.series[index-1]
+			current = (series['host'],series['sen'],series['key'])
+		else:
+			return
+		if current != source:
+			return
+		old = self.data if index == 0 else self.series[index-1]['data']
+		# history up to the first sample we already have
+		times = old.times()
+		if len(old):
+			rows = [row for row in rows if row[0] < times[0]]
+		data = new_buffer()
+		data.extend([value for t, value in rows],[t for t, value in rows])
+		data.extend(old.values(),times)
+		if index == 0:
+			self.data = data
+		else:
+			self.series[index-1]['data'] = data
+		self.set_title_status()
+		if not self.browsing():
+			self.chart.set_data(data,index)
 
 	def on_pause(self,*args):
 		if self.paused:
@@ -217,24 +372,50 @@ class ChartWindow(Gtk.Window):
 		self.update(False)
 
 	def on_clear(self,*args):
-		self.data = boundlist.BoundList(50)
+		self.go_live()
+		self.data = new_buffer()
+		for index, binding in enumerate(self.series):
+			binding['data'] = new_buffer()
+			self.chart.set_data(binding['data'],index+1)
 		self.update(False)
 
 	def reset_timer(self):
-		ms = self.interval
-		debug(ms)
-		if ms < 100:
-			ms = 100
-		if self.update_timeout:
-			GLib.source_remove(self.update_timeout)
-		self.update_timeout = GLib.timeout_add(ms,self._trigger)
+		'''
+		start sampling: the chart is updated on each new reading from the
+		hub, but no more than once per interval
+		'''
+		debug(self.interval)
+		self.stop_timer()
+		hub = SensorHub.get()
+		sensors = {(self.host,self.sen)} | {(b['host'],b['sen']) for b in self.series}
+		for host, sen in sensors:
+			self.hub_tokens.append(hub.subscribe(host,sen,
+				lambda reading, key=(host,sen): self.on_reading(key,reading),
+				self.data_path))
 	
 	def stop_timer(self):
+		''' stop sampling '''
 		debug()
-		if self.update_timeout:
-			GLib.source_remove(self.update_timeout)
-			self.update_timeout = None
-			
+		hub = SensorHub.get()
+		for token in self.hub_tokens:
+			hub.unsubscribe(token)
+		self.hub_tokens = []
+		self.reading = None
+		self.readings = {}
+		if self.sample_timeout:
+			GLib.source_remove(self.sample_timeout)
+			self.sample_timeout = None
+
+	def on_reading(self,key,reading):
+		'''
+		the hub has a new reading for one of our sensors. Sensors shared by
+		several series are only read once.
+		'''
+		self.readings[key] = reading
+		if key == (self.host,self.sen):
+			self.reading = reading
+		self._trigger()
+
 
 	def _construct_cobj(self):
 		cobj = {}
@@ -243,10 +424,13 @@ class ChartWindow(Gtk.Window):
 		cobj['line_color'] = self.line_color
 		cobj['line_width'] = self.line_width
 		cobj['interval'] = self.interval
+		cobj['autoscale'] = self.autoscale
 		cobj['min_value'] = self.min_value
 		cobj['max_value'] = self.max_value
 		cobj['units'] = self.units
 		cobj["key"] = self.key
+		if self.series:
+			cobj['bindings'] = [[self.name,self.key]] + [[b['name'],b['key']] for b in self.series]
 		return cobj	
 
 	def _resolve_cobj(self,cobj):
@@ -255,6 +439,7 @@ class ChartWindow(Gtk.Window):
 		self.line_color = cobj['line_color']
 		self.line_width = cobj['line_width']
 		self.interval = cobj['interval']
+		self.autoscale = cobj.get('autoscale',False)
 		self.min_value = cobj['min_value']
 		self.max_value = cobj['max_value']
 		self.units = cobj['units']
@@ -271,23 +456,32 @@ class ChartWindow(Gtk.Window):
 			on_complete=self.on_chart_config_complete,
 			key=self.key,
 			sensor_name = self.name,
-			sensor_type = self.sen
+			sensor_type = self.sen,
+			sensors = self.config['sensors']
 		)
 		self.config_window.move(*self.position())
 
 	def reconfig(self, newkey, cobj):
 		debug()
 		self.chart_obj = self._resolve_cobj(cobj)
-		self.chart.set_scale(self.min_value,self.max_value,False)
+		self.chart.set_scale(self.min_value,self.max_value,self.autoscale)
 		self.chart.set_colors(
 			line_color=self.line_color,
 			legend_color=self.legend_color,
 			background_color=self.background_color
 			)
 		self.chart.set_line_width(self.line_width)
+		# a zoomed in or out view keeps its window until go_live
+		if not self.browsing():
+			self.chart.set_time_window(self.time_window(),self.gap())
 		if newkey != self.key:
-			self.data = boundlist.BoundList(50)
+			self.go_live()
+			self.data = new_buffer()
+			self.chart.set_data(self.data)
 		self.key = newkey
+		self.set_bindings(cobj.get('bindings'))
+		if self.series:
+			self.chart.series[0].name = f'{self.name} {self.key}'
 		debug("Calling save config")
 		self.cobj = cobj
 
@@ -360,7 +554,8 @@ class ChartWindow(Gtk.Window):
 			icon = 'media-playback-pause'
 			tooltip = 'Pause chart'
 		self.toolbar.change_button_image('Pause chart',icon,tooltip)
-		self.set_title(f'{self.name} - {self.key} {paused}{samples}')
+		keys = ', '.join([self.key] + [f"{b['name']} {b['key']}" for b in self.series])
+		self.set_title(f'{self.name} - {keys} {paused}{samples}')
 		
 
 	def position(self, new_position=None):
@@ -378,7 +573,7 @@ class ChartWindow(Gtk.Window):
 			debug("No key set")
 			return
 		if read_data:
-			sdata = self.sensor.read()
+			sdata = self.reading
 			if not sdata or 'error' in sdata:
 				debug("error, sdata",sdata)
 				return
@@ -393,27 +588,188 @@ class ChartWindow(Gtk.Window):
 			self.vlabel.set_text(v)
 			self.vcap.set_text(f'Charted Value {self.key}')
 			self.vunits.set_text(u)
-			self.data.append(value)
+			timestamp = reading_time(sdata)
+			if self.browsing():
+				# the chart is showing history, keep the live data for later
+				self.data.append(value,timestamp)
+				for binding, v in zip(self.series,self.series_values()):
+					binding['data'].append(math.nan if v is None else v,timestamp)
+			else:
+				# the chart shares the buffers and appends to them
+				self.chart.append(value,*self.series_values(),timestamp=timestamp)
 		else:
 			self.vlabel.set_text('waiting...')
 			self.vunits.set_text('')
+			if not self.browsing():
+				self.chart.set_data(self.data)
 		self.set_title_status()
+
+	def connect_browsing(self):
+		''' scroll to zoom, drag to pan, double click to go back to live '''
+		canvas = self.chart.canvas
+		canvas.add_events(
+			Gdk.EventMask.SCROLL_MASK |
+			Gdk.EventMask.BUTTON_PRESS_MASK |
+			Gdk.EventMask.BUTTON_RELEASE_MASK |
+			Gdk.EventMask.BUTTON1_MOTION_MASK)
+		canvas.connect('scroll-event',self.on_chart_scroll)
+		canvas.connect('button-press-event',self.on_chart_press)
+		canvas.connect('motion-notify-event',self.on_chart_motion)
+		canvas.connect('button-release-event',self.on_chart_release)
+		canvas.set_tooltip_text('Scroll to zoom, drag to look back, double click to go back to live')
+
+	def browsing(self):
+		''' True when the chart shows history rather than following the readings '''
+		return self.chart.view_end is not None
+
+	def on_chart_scroll(self,widget,event):
+		if event.direction == Gdk.ScrollDirection.UP:
+			factor = 1/1.25
+		elif event.direction == Gdk.ScrollDirection.DOWN:
+			factor = 1.25
+		else:
+			return False
+		start, end = self.chart.time_range()
+		window = self.chart.time_window
+		new_window = min(max(window * factor,self.time_window()/5),history.tiers[-1]['retention'])
+		# keep the time under the pointer where it is
+		where = min(max(event.x / max(self.chart.width - 10,1),0),1)
+		pointer = start + where * window
+		new_end = pointer + (1 - where) * new_window
+		self.browse(min(new_end,time.time()),new_window)
+		return True
+
+	def on_chart_press(self,widget,event):
+		if event.button != 1:
+			return False
+		if event.type == Gdk.EventType._2BUTTON_PRESS:
+			self.drag = None
+			self.go_live()
+			return True
+		self.drag = (event.x,self.chart.time_range()[1])
+		return True
+
+	def on_chart_motion(self,widget,event):
+		if not self.drag:
+			return False
+		x, end = self.drag
+		moved = (x - event.x) / max(self.chart.width - 10,1) * self.chart.time_window
+		if moved:
+			self.browse(min(end + moved,time.time()),self.chart.time_window)
+		return True
+
+	def on_chart_release(self,widget,event):
+		self.drag = None
+		return False
+
+	def browse(self,end,window):
+		''' show window seconds of history up to end, loading it when things settle '''
+		self.chart.view_end = end
+		self.chart.set_time_window(window,self.chart.gap)
+		if self.fetch_timeout:
+			GLib.source_remove(self.fetch_timeout)
+		self.fetch_timeout = GLib.timeout_add(100,self.fetch_history)
+
+	def go_live(self):
+		''' follow the readings again '''
+		if self.fetch_timeout:
+			GLib.source_remove(self.fetch_timeout)
+			self.fetch_timeout = None
+		if not self.browsing() and self.chart.time_window == self.time_window():
+			return
+		self.fetch_generation += 1
+		self.chart.view_end = None
+		self.chart.set_time_window(self.time_window(),self.gap())
 		self.chart.set_data(self.data)
+		for index, binding in enumerate(self.series):
+			self.chart.set_data(binding['data'],index+1)
+
+	def fetch_history(self):
+		'''
+		load the visible range from the history database in the background,
+		at the tier that gives no more points than the chart is wide
+		'''
+		self.fetch_timeout = None
+		path = self.config.get('history_db','history.db')
+		if not self.browsing() or not os.path.exists(path):
+			return False
+		start, end = self.chart.time_range()
+		max_points = max(self.chart.width - 10,10)
+		wanted = [(self.host,self.sen,self.key)] + [(b['host'],b['sen'],b['key']) for b in self.series]
+		self.fetch_generation += 1
+		generation = self.fetch_generation
+
+		def load():
+			store = history.open_history(path)
+			return [store.browse(host,sen,key,start,end,max_points) for host, sen, key in wanted]
+
+		get_bgio().submit(load,
+			callback=lambda results: self.on_history(generation,results),
+			owner=self)
+		return False
+
+	def on_history(self,generation,results):
+		''' show history loaded by fetch_history '''
+		if generation != self.fetch_generation or not self.browsing():
+			return
+		gap = self.gap()
+		for index, (tier, rows) in enumerate(results):
+			values, times = history_samples(tier,rows)
+			data = RingBuffer(max(len(values),1),timestamps=True)
+			data.extend(values,times)
+			self.chart.set_data(data,index)
+			# the collector may sample less often than we do
+			if len(rows) > 2:
+				steps = [b[0] - a[0] for a, b in zip(rows,rows[1:])]
+				gap = max(gap,3 * statistics.median(steps))
+		self.chart.set_time_window(self.chart.time_window,gap)
+
+	def time_window(self):
+		''' seconds shown on the chart, chart_samples readings '''
+		return chart_samples * max(self.interval,100) / 1000
+
+	def gap(self):
+		''' readings further apart than this are missing some in between '''
+		return 3 * max(self.interval,100) / 1000
+
+	def series_values(self):
+		''' the latest value for each added series, None where there is none '''
+		values = []
+		for binding in self.series:
+			reading = self.readings.get((binding['host'],binding['sen']))
+			value = reading.get(binding['key']) if reading else None
+			values.append(value if type(value) in (int,float) else None)
+		return values
 
 	def _trigger(self):
+		'''
+		take a sample if one is due, otherwise make sure one is taken
+		when it is
+		'''
 		if self.reconfig_timer:
 			self.reset_timer()
 			return False
-		if self.keepging:
-			self.update()
-			return True
-		else:
+		if not self.keepging or not self.hub_tokens or self.sample_timeout:
 			return False
+		interval = max(self.interval,100)/1000
+		wait = self.last_sample + interval - time.monotonic()
+		if wait > 0:
+			self.sample_timeout = GLib.timeout_add(int(wait*1000)+1,self._sample_due)
+			return False
+		self.last_sample = time.monotonic()
+		self.update()
+		return False
+
+	def _sample_due(self):
+		self.sample_timeout = None
+		return self._trigger()
 
 	def stopit(self,*args):
 		self.save_config()
 		debug("bye")
 		self.keepging = False
+		self.stop_timer()
+		get_bgio().cancel_owner(self)
 		if callable(self.on_close):
 			self.on_close(self.name)
 		self.destroy()
@@ -424,6 +780,7 @@ class ChartWindow(Gtk.Window):
 		if callable(self.config_callback):
 			keys_to_save = [
 				'active',
+				'autoscale',
 				'background_color',
 				'key',
 				'interval',
@@ -436,6 +793,8 @@ class ChartWindow(Gtk.Window):
 				'units',
 			]
 			cobj = {key: self.__dict__[key] for key in keys_to_save}
+			if self.series:
+				cobj['bindings'] = [[self.name,self.key]] + [[b['name'],b['key']] for b in self.series]
 			debug("sending config data to app for save")
 			self.config_callback(self.name,cobj)
 
@@ -451,13 +810,12 @@ if __name__ == "__main__":
 		key = sys.argv[2]
 
 	try:
-		with open('sensors.json') as f:
-			config = json.load(f)
+		config = cfg.get_config()
 	except:
 		print("Can't read sensors.json",file=sys.stderr)
 		sys.exit(1)
 	
-	change_theme(config['dark_mode'])
+	change_theme(config.get('dark_mode',False))
 
 	if name in config['sensors']:
 		cobj = config['sensors'][name]['chart']
@@ -4,38 +4,119 @@ module to create plots and reports from sqlite data
 import os
 import sys
 import sqlite3
+import io
+import multiprocessing
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import base64
+from dateutil import tz
 
 if sys.platform == 'darwin':
 	database = os.path.expanduser('~/Network/pi4/home/nicci/db/datacollect.db')
 else:
 	database = os.path.expanduser('~/db/datacollect.db')
 
-def get_table_dataframe(database, host,sensor, key, filename=False):
+def ensure_time_index(con, table):
+	'''
+	create an index on time for table so range queries don't scan the table.
+	The database may be read only, in which case we go without.
+	'''
+	try:
+		con.execute(f'create index if not exists {table}_time on {table} (time)')
+		con.commit()
+	except sqlite3.OperationalError:
+		pass
+
+def get_table_dataframe(database, host,sensor, key, filename=False, start=None, end=None, bucket=None, max_points=None):
 	'''
 	get a pandas datafrom from the database fpr host, sensor, key and optionally 
-	create a plot and generate html report
+	create a plot and generate html report. 
+	start and end limit the query to a range of unix times. bucket, in seconds,
+	averages the data over buckets of that size in sqlite; with max_points 
+	and no bucket the bucket size is chosen so at most max_points rows 
+	come back. 
 	'''
-	sql = f"select datetime(time,'unixepoch','localtime') as date, {key} from {host}_{sensor};"
+	table = f'{host}_{sensor}'
 	con = sqlite3.connect(database)
-	dataframe = pd.read_sql_query(sql,con)
+	ensure_time_index(con, table)
+	where = []
+	params = []
+	if start is not None:
+		where.append('time >= ?')
+		params.append(start)
+	if end is not None:
+		where.append('time < ?')
+		params.append(end)
+	where = f"where {' and '.join(where)}" if where else ''
+	origin = 0
+	if max_points and not bucket:
+		first, last = con.execute(f'select min(time), max(time) from {table} {where}', params).fetchone()
+		if first is not None and last > first:
+			# buckets start at the first sample and are just wide enough
+			# that the last one still falls in bucket max_points - 1
+			bucket = int((last - first) // max_points) + 1
+			origin = first
+	if bucket and bucket > 1:
+		sql = f'''select {origin} + cast((time - {origin}) / {int(bucket)} as integer) * {int(bucket)} as time, avg({key}) as {key}
+			from {table} {where} group by 1 order by 1'''
+	else:
+		sql = f'select time, {key} from {table} {where} order by time'
+	dataframe = pd.read_sql_query(sql, con, params=params)
 	con.close()
+	dates = pd.to_datetime(dataframe['time'], unit='s', utc=True)
+	dataframe['time'] = dates.dt.tz_convert(tz.tzlocal()).dt.tz_localize(None)
+	dataframe.rename(columns={'time': 'date'}, inplace=True)
 	if filename:
 		plot_data_frame(host,sensor,dataframe,key, filename)
 	return dataframe
 
 
+titles = {
+	'temp': "Temperature",
+	'humidity': "Humitidy",
+	"pressure": "Barometer"
+}
+
+def data_stats(series):
+	'''
+	min, max and average of a series, rounded to 2 places, from one
+	aggregate call
+	'''
+	stats = series.agg(['min','max','mean'])
+	return round(stats['min'],2), round(stats['max'],2), round(stats['mean'],2)
+
+def render_plot(dataframe):
+	'''
+	plot dataframe to a PNG held in memory and return the buffer
+	'''
+	fig, ax = plt.subplots()
+	dataframe.plot(ax=ax)
+	ax.set_xlabel('Date')
+	ax.set_ylabel('Values')
+	buf = io.BytesIO()
+	fig.savefig(buf, format='png')
+	plt.close(fig)
+	buf.seek(0)
+	return buf
+
+def write_base64(f, buf, chunk_size=48*1024):
+	'''
+	base64 encode the binary file buf into the text file f a chunk at a 
+	time. chunk_size is a multiple of 3 so the chunks join up.
+	'''
+	while True:
+		chunk = buf.read(chunk_size)
+		if not chunk:
+			break
+		f.write(base64.b64encode(chunk).decode('ascii'))
+
 def plot_data_frame(host,sensor,dataframe,key,filename,pagetitle=None):
 	'''
 	plot chart from dataframe and create html report in filename
 	'''
-	titles = {
-		'temp': "Temperature",
-		'humidity': "Humitidy",
-		"pressure": "Barometer"
-	}
+	title = titles.get(key, key)
 	dataframe.columns = ['date', key]
 
 	# Convert 'date' column to datetime
@@ -44,23 +125,12 @@ def plot_data_frame(host,sensor,dataframe,key,filename,pagetitle=None):
 	# Set 'date' column as index
 	dataframe.set_index('date', inplace=True)
 
-	# Plot
-	temp = f'/tmp/plot.{os.getpid()}.png'
-	dataframe.plot()
-	data_min = round(dataframe.min().iloc[0],2)
-	data_max = round(dataframe.min().iloc[0],2)
-	data_avg = round(dataframe.mean().iloc[0],2)
-	plt.xlabel('Date')
-	plt.ylabel('Values')
-	plt.title(f'')
-	plt.savefig(temp)
-	with open(temp,'rb') as f:
-		imgdata = base64.b64encode(f.read())
-	imgdata = imgdata.decode('ascii')
-	os.unlink(temp)
+	data_min, data_max, data_avg = data_stats(dataframe[key])
+	image = render_plot(dataframe)
 	if not pagetitle:
-		pagetitle = f'{titles[key]} for {sensor} on {host}'
-	html = f"""
+		pagetitle = f'{title} for {sensor} on {host}'
+	with open(filename,'w') as f:
+		f.write(f"""
 	<!DOCTYPE html>
 	<!-- Auto generated by sensors-gui app -->
 	<html>
@@ -76,21 +146,47 @@ def plot_data_frame(host,sensor,dataframe,key,filename,pagetitle=None):
 	<h1>{pagetitle}</h1>
 	Sensor host {host}<br/>
 	Sensor type {sensor}<br/>
-	Minimum {titles[key]}: {data_min}<br/>
-	Maximum {titles[key]}: {data_max}<br/>
-	Average {titles[key]}  {data_avg}<br/>
+	Minimum {title}: {data_min}<br/>
+	Maximum {title}: {data_max}<br/>
+	Average {title}  {data_avg}<br/>
 	<div>
-		<img src="data:image/png;base64, {imgdata}" />
+		<img src="data:image/png;base64, """)
+		write_base64(f, image)
+		f.write("""" />
 	</div>
 	</body>
 	</html>
-	"""
-	with open(filename,'w') as f:
-		f.write(html)
+	""")
+
+def _report_job(job):
+	'''
+	run one report for generate_reports in a worker process
+	'''
+	database, host, sensor, key, filename, pagetitle, options = job
+	try:
+		df = get_table_dataframe(database, host, sensor, key, **options)
+		plot_data_frame(host, sensor, df, key, filename, pagetitle)
+	except Exception as e:
+		return (filename, str(e))
+	return (filename, None)
+
+def generate_reports(database, jobs, processes=None, **options):
+	'''
+	generate many reports in parallel. jobs is a list of 
+	(host, sensor, key, filename) or (host, sensor, key, filename, pagetitle).
+	options are passed to get_table_dataframe, e.g. start, end, max_points.
+	Returns a list of (filename, error), error is None for success.
+	'''
+	work = []
+	for job in jobs:
+		host, sensor, key, filename = job[:4]
+		pagetitle = job[4] if len(job) > 4 else None
+		work.append((database, host, sensor, key, filename, pagetitle, options))
+	with multiprocessing.Pool(processes) as pool:
+		return list(pool.imap_unordered(_report_job, work))
+
 if __name__ == "__main__":
 	host = 'pi3'
 	sensor = 'aht10'
 	df = get_table_dataframe(database,host,sensor, 'temp')
 	plot_data_frame(host,sensor,df,'temp','chart.html',"Terry's Room Temperature")
-
-
@@ -7,21 +7,122 @@ import numpy as np
 import cairo
 sys.path.append(os.path.expanduser('~/lib'))
 import httpsen2
+import math
+import time
+from functools import lru_cache
 from dflib.debug import debug, set_debug
+from dflib.ringbuffer import RingBuffer
+
+@lru_cache(maxsize=64)
+def hex_to_rgb(hex_color):
+	hex_color = hex_color.lstrip('#')
+	return tuple(int(hex_color[i:i+2], 16) / 255 for i in (0, 2, 4))
+
+def decimate(x, y):
+	'''
+	min-max decimation of a line sorted by x, reduce the points falling in
+	each pixel column to its lowest and highest point.
+	'''
+	columns = x.astype(int)
+	starts = np.flatnonzero(np.diff(columns)) + 1
+	starts = np.concatenate(([0], starts))
+	# fmin and fmax skip missing samples, a column with none left is a gap
+	lows = np.fmin.reduceat(y, starts)
+	highs = np.fmax.reduceat(y, starts)
+	out_x = np.repeat(columns[starts].astype(float), 2)
+	out_y = np.empty(len(out_x))
+	out_y[0::2] = lows
+	out_y[1::2] = highs
+	return out_x, out_y
+
+def nice_number(value, round_it):
+	'''
+	a number close to value that is 1, 2 or 5 times a power of ten, the
+	nearest if round_it or the next up if not
+	'''
+	exponent = math.floor(math.log10(value))
+	fraction = value / 10 ** exponent
+	if round_it:
+		steps = [(1.5, 1), (3, 2), (7, 5)]
+		nice = next((n for limit, n in steps if fraction < limit), 10)
+	else:
+		steps = [(1, 1), (2, 2), (5, 5)]
+		nice = next((n for limit, n in steps if fraction <= limit), 10)
+	return nice * 10 ** exponent
+
+def nice_scale(low, high, max_ticks=5):
+	'''
+	a scale from low to high widened to round numbers, as (min, max, step)
+	with about max_ticks ticks step apart
+	'''
+	if high <= low:
+		pad = abs(low) * 0.1 or 1
+		low -= pad
+		high += pad
+	span = nice_number(high - low, False)
+	step = nice_number(span / (max_ticks - 1), True)
+	# round away the float noise in the multiplications
+	return round(math.floor(low / step) * step, 12), round(math.ceil(high / step) * step, 12), step
+
+class Series:
+	'''
+	One line on a LiveChart: its samples, color and the range of values
+	mapped onto the height of the chart.
+	'''
+	def __init__(self, **kwargs):
+		self.name = kwargs.get('name', '')
+		self.line_color = kwargs.get('line_color', 'blue')
+		self.min_value = kwargs.get('min_value', 0)
+		self.max_value = kwargs.get('max_value', 100)
+		self.data = kwargs.get('data')
+		if self.data is None:
+			self.data = RingBuffer(kwargs.get('capacity', 50), timestamps=kwargs.get('timestamps', False))
+		self.last_y = None
+
+	def key(self):
+		return (self.name, self.line_color, self.min_value, self.max_value)
+
 class LiveChart(Gtk.Box):
+	'''
+	A line chart of one or more series sharing the X axis. The tick marks
+	and labels show the scale of the first series, each series is plotted
+	on its own scale.
+	Samples are evenly spaced unless time_window is set. Then the X axis
+	is the last time_window seconds, samples are placed by their
+	timestamps and two samples more than gap seconds apart are not
+	joined.
+	'''
 	def __init__(self, width, height, **kwargs):
 		super().__init__()
 		self.scale_set = False
 		self.width = width
 		self.height = height
+		self.scrolling = kwargs.get('scrolling', False)
+		self.capacity = kwargs.get('capacity', 50)
+		self.time_window = kwargs.get('time_window')
+		self.gap = kwargs.get('gap')
+		self.view_end = None
+		self.series = [Series(
+			line_color=kwargs.get('line_color', 'blue'),
+			min_value=kwargs.get('min_value', 0),
+			max_value=kwargs.get('max_value', 100),
+			capacity=self.capacity,
+			timestamps=bool(self.time_window))]
 		self.background_color = kwargs.get('background_color', 'white')
 		self.legend_color = kwargs.get('legend_color', 'black')
-		self.line_color = kwargs.get('line_color', 'blue')
 		self.line_width = kwargs.get('line_width', 2)
-		self.min_value = kwargs.get('min_value', 0)
-		self.max_value = kwargs.get('max_value', 100)
 		self.relative_scale = kwargs.get('relative_scale')
-		self.data = []
+		self.shrink = kwargs.get('shrink', 0.4)
+		self.fixed_min = self.min_value
+		self.fixed_max = self.max_value
+		self.tick_step = None
+		self.static_surface = None
+		self.static_surface_key = None
+		self.line_surface = None
+		self.line_surface_key = None
+		self.line_spare = None
+		self.line_x = None
+		self.line_t = None
 
 		self.canvas = Gtk.DrawingArea()
 		self.canvas.set_size_request(width - 10, height - 10)  # Offset by 10 pixels
@@ -30,6 +131,59 @@ class LiveChart(Gtk.Box):
 		self.connect('configure-event',self.on_configure)
 		self.connect("draw", self.on_draw)
 
+	# the first series is the chart's own data, color and scale
+	@property
+	def data(self):
+		return self.series[0].data
+
+	@data.setter
+	def data(self, data):
+		self.series[0].data = data
+
+	@property
+	def line_color(self):
+		return self.series[0].line_color
+
+	@line_color.setter
+	def line_color(self, color):
+		self.series[0].line_color = color
+
+	@property
+	def min_value(self):
+		return self.series[0].min_value
+
+	@min_value.setter
+	def min_value(self, value):
+		self.series[0].min_value = value
+
+	@property
+	def max_value(self):
+		return self.series[0].max_value
+
+	@max_value.setter
+	def max_value(self, value):
+		self.series[0].max_value = value
+
+	def add_series(self, **kwargs):
+		'''
+		add a series, kwargs are those of Series. Returns its index, the
+		value for it is at that position in the arguments to append.
+		'''
+		kwargs.setdefault('capacity', self.capacity)
+		kwargs.setdefault('timestamps', bool(self.time_window))
+		self.series.append(Series(**kwargs))
+		self.line_surface = None
+		self.queue_draw()
+		return len(self.series) - 1
+
+	def remove_series(self, index):
+		''' remove a series added with add_series '''
+		if index == 0:
+			raise ValueError('the first series cannot be removed')
+		del self.series[index]
+		self.line_surface = None
+		self.queue_draw()
+
 	def set_colors(self,**kwargs):
 		for k,v in kwargs.items():
 			debug(k,v)
@@ -45,32 +199,315 @@ class LiveChart(Gtk.Box):
 		widget.queue_draw()
 
 	def on_draw(self, widget, cr):
-		# Set background color
-		cr.set_source_rgb(*self.hex_to_rgb(self.background_color))
+		cr.set_source_surface(self.static_layer(), 0, 0)
 		cr.paint()
+		if self.scrolling:
+			cr.set_source_surface(self.line_layer(), 0, 0)
+			cr.paint()
+		else:
+			self.draw_lines(cr)
 
-		# Draw Y-axis tick marks and labels
-		num_ticks = 5
-		tick_spacing = (self.height - 10) / (num_ticks - 1)  # Adjusted spacing
-		# Draw line graph
-		try:
-			#debug(self.min_value,self.max_value)
-			cr.set_source_rgb(*self.hex_to_rgb(self.line_color))
-			cr.set_line_width(self.line_width)
-			num_points = len(self.data)
-			if num_points >= 1:
-				x_spacing = (self.width - 10) / (num_points - 1)  # Adjusted spacing
-				for i in range(num_points - 1):
-					x1 = i * x_spacing
-					y1 = (self.data[i] - self.min_value) / (self.max_value - self.min_value) * (self.height - 10)  # Adjusted y position
-					x2 = (i + 1) * x_spacing
-					y2 = (self.data[i + 1] - self.min_value) / (self.max_value - self.min_value) * (self.height - 10)  # Adjusted y position
-					cr.move_to(x1, self.height - y1 - 5)  # Adjusted y position
-					cr.line_to(x2, self.height - y2 - 5)  # Adjusted y position
-					cr.stroke()
-		except ZeroDivisionError:
-			pass
+	def new_surface(self, fmt):
+		'''
+		an offscreen surface the size of the chart at the screen's scale, so
+		the layers stay sharp on HiDPI displays. Drawing on it is in the
+		same units as the widget.
+		'''
+		width = max(self.width, 1)
+		height = max(self.height, 1)
+		scale = self.get_scale_factor()
+		window = self.get_window()
+		if window is not None:
+			return window.create_similar_image_surface(fmt, width, height, scale)
+		surface = cairo.ImageSurface(fmt, width * scale, height * scale)
+		surface.set_device_scale(scale, scale)
+		return surface
+
+	def static_key(self):
+		''' everything the static layer depends on '''
+		return (self.width, self.height, self.get_scale_factor(), self.min_value, self.max_value, self.tick_step,
+			self.background_color, self.legend_color, self.line_width,
+			tuple((s.name, s.line_color) for s in self.series))
+
+	def static_layer(self):
+		'''
+		the background, tick marks and labels drawn on an offscreen surface.
+		They only change with the size, scale or colors of the chart, so the
+		surface is kept and redrawn only when one of those changes.
+		'''
+		key = self.static_key()
+		if self.static_surface is None or key != self.static_surface_key:
+			surface = self.new_surface(cairo.FORMAT_RGB24)
+			cr = cairo.Context(surface)
+			# Set background color
+			cr.set_source_rgb(*self.hex_to_rgb(self.background_color))
+			cr.paint()
+			self.draw_ticks(cr)
+			self.draw_legend(cr)
+			surface.flush()
+			self.static_surface = surface
+			self.static_surface_key = key
+		return self.static_surface
+
+	def line_key(self):
+		return ((self.width, self.height, self.get_scale_factor(), self.line_width, self.time_window, self.gap, self.view_end)
+			+ tuple(s.key() for s in self.series))
+
+	def new_line_surface(self):
+		''' a transparent surface for the lines, reusing the spare one if it fits '''
+		surface = self.line_spare
+		self.line_spare = None
+		scale = self.get_scale_factor()
+		if (surface is None or surface.get_device_scale() != (scale, scale)
+				or surface.get_width() != max(self.width, 1) * scale
+				or surface.get_height() != max(self.height, 1) * scale):
+			surface = self.new_surface(cairo.FORMAT_ARGB32)
+		cr = cairo.Context(surface)
+		cr.set_operator(cairo.OPERATOR_CLEAR)
+		cr.paint()
+		return surface
+
+	def line_layer(self):
+		'''
+		the lines drawn on their own transparent surface, for scrolling mode.
+		append() scrolls it and adds the newest segments, it is only drawn
+		in full after a resize, a change of scale or colors, or set_data.
+		'''
+		key = self.line_key()
+		if self.line_surface is None or key != self.line_surface_key:
+			if self.line_surface is not None:
+				self.line_spare = self.line_surface
+			surface = self.new_line_surface()
+			self.draw_lines(cairo.Context(surface))
+			surface.flush()
+			self.line_surface = surface
+			self.line_surface_key = key
+			length = self.length()
+			if self.time_window:
+				end = self.time_range()[1] if length else None
+				self.line_t = end
+				self.line_x = self.width - 10 if length else None
+				for series in self.series:
+					times = series.data.times()
+					if len(series.data) and times[-1] == end:
+						series.last_y = self.value_y(series, series.data[-1])
+					else:
+						series.last_y = None
+			else:
+				self.line_x = (length - 1) * self.x_spacing(length) if length else None
+				for series in self.series:
+					series.last_y = self.value_y(series, series.data[-1]) if len(series.data) else None
+		return self.line_surface
+
+	def time_range(self):
+		'''
+		the start and end times of the X axis, ending at view_end or,
+		when that is None, at the newest sample
+		'''
+		end = self.view_end
+		if end is None:
+			ends = [s.data.times()[-1] for s in self.series if len(s.data)]
+			end = max(ends) if ends else time.time()
+		return end - self.time_window, end
+
+	def length(self):
+		''' the number of samples in the longest series '''
+		return max(len(s.data) for s in self.series)
+
+	def set_time_window(self, seconds, gap=None):
+		''' show the last seconds on the X axis, gap as for the constructor '''
+		self.time_window = seconds
+		self.gap = gap
+		self.queue_draw()
+
+	def x_spacing(self, num_points):
+		''' pixels between samples, a scrolling chart is always laid out for capacity samples '''
+		if self.scrolling:
+			num_points = self.capacity
+		return (self.width - 10) / max(num_points - 1, 1)  # Adjusted spacing
 
+	def value_y(self, series, value):
+		span = series.max_value - series.min_value
+		if span == 0:
+			return math.nan
+		return self.height - 5 - (value - series.min_value) / span * (self.height - 10)
+
+	def scroll(self, values, timestamp=None):
+		'''
+		add values to the line surface without redrawing it: shift it left
+		when the lines reach the right edge and draw the new segments.
+		'''
+		if self.line_surface is None or self.line_x is None or self.line_key() != self.line_surface_key:
+			self.line_surface = None
+			return
+		if self.view_end is not None:
+			# looking at the past, the new sample is off the chart
+			return
+		joined = True
+		x0 = self.line_x
+		if self.time_window:
+			elapsed = timestamp - self.line_t
+			if elapsed <= 0:
+				self.line_surface = None
+				return
+			x1 = x0 + elapsed / self.time_window * (self.width - 10)
+			joined = not self.gap or elapsed <= self.gap
+			self.line_t = timestamp
+		else:
+			x1 = x0 + self.x_spacing(self.capacity)
+		surface = self.line_surface
+		overflow = x1 - (self.width - 10)
+		if overflow > 0:
+			# shift by whole pixels so the lines stay sharp
+			shift = math.ceil(overflow)
+			shifted = self.new_line_surface()
+			cr = cairo.Context(shifted)
+			cr.set_source_surface(surface, -shift, 0)
+			cr.paint()
+			self.line_spare = surface
+			self.line_surface = surface = shifted
+			x0 -= shift
+			x1 -= shift
+		cr = cairo.Context(surface)
+		cr.set_line_width(self.line_width)
+		cr.set_line_cap(cairo.LINE_CAP_ROUND)
+		for series, value in zip(self.series, values):
+			y0 = series.last_y
+			y1 = self.value_y(series, value)
+			if joined and y0 is not None and not math.isnan(y0) and not math.isnan(y1):
+				cr.set_source_rgb(*self.hex_to_rgb(series.line_color))
+				cr.move_to(x0, y0)
+				cr.line_to(x1, y1)
+				cr.stroke()
+			series.last_y = y1
+		surface.flush()
+		self.line_x = x1
+
+	def append(self, *values, timestamp=None):
+		'''
+		add one sample to each series, values are in the order the series
+		were added. None is a missing sample and leaves a gap. timestamp
+		defaults to now. In scrolling mode the cost does not depend on the
+		number of samples shown.
+		'''
+		if len(values) != len(self.series):
+			raise ValueError(f'expected {len(self.series)} values, got {len(values)}')
+		if timestamp is None:
+			timestamp = time.time()
+		values = [math.nan if v is None else float(v) for v in values]
+		for series, value in zip(self.series, values):
+			series.data.append(value, timestamp)
+		if self.scrolling:
+			# a new scale changes the line key and redraws the lines
+			if self.relative_scale:
+				self.autoscale()
+			if self.length() == 1:
+				self.line_surface = None
+			else:
+				self.scroll(values, timestamp)
+			self.canvas.queue_draw()
+		else:
+			self.set_scale(None,None)
+
+	def plot_points(self, series):
+		'''
+		map the data of series to pixel coordinates in one pass. Returns
+		arrays of x and y, or None if there is nothing to draw. Missing
+		samples are NaN. When there are more points than pixel columns each
+		column is reduced to its minimum and maximum, so the cost of
+		drawing depends on the width of the chart and not the length of
+		the data. Shorter series are aligned with the newest sample.
+		'''
+		data = series.data.values()
+		span = series.max_value - series.min_value
+		if len(data) < 2 or span == 0:
+			return None
+		plot_width = self.width - 10
+		plot_height = self.height - 10
+		if self.time_window:
+			times = series.data.times()
+			if times is None:
+				return None
+			start, end = self.time_range()
+			# the visible samples, and the one either side so the line
+			# runs to the edges
+			first = max(np.searchsorted(times, start, 'left') - 1, 0)
+			last = np.searchsorted(times, end, 'right') + 1
+			times = times[first:last]
+			data = data[first:last]
+			if len(data) < 2:
+				return None
+			x = (times - start) / self.time_window * plot_width
+		else:
+			length = self.length()
+			x = (np.arange(len(data)) + (length - len(data))) * self.x_spacing(length)
+		y = self.height - 5 - (data - series.min_value) / span * plot_height
+		if len(data) > 2 * plot_width > 0:
+			x, y = decimate(x, y)
+		if self.time_window and self.gap:
+			gap = self.gap / self.time_window * plot_width
+			breaks = np.flatnonzero(np.diff(x) > gap) + 1
+			if len(breaks):
+				x = np.insert(x, breaks, np.nan)
+				y = np.insert(y, breaks, np.nan)
+		return x, y
+
+	def draw_lines(self, cr):
+		for series in self.series:
+			self.draw_line(cr, series)
+
+	def draw_line(self, cr, series):
+		points = self.plot_points(series)
+		if points is None:
+			return
+		x, y = points
+		cr.set_source_rgb(*self.hex_to_rgb(series.line_color))
+		cr.set_line_width(self.line_width)
+		cr.set_line_join(cairo.LINE_JOIN_ROUND)
+		cr.set_line_cap(cairo.LINE_CAP_ROUND)
+		pen_up = True
+		for px, py in zip(x.tolist(), y.tolist()):
+			if py != py:
+				# a missing sample, leave a gap
+				pen_up = True
+			elif pen_up:
+				cr.move_to(px, py)
+				pen_up = False
+			else:
+				cr.line_to(px, py)
+		cr.stroke()
+
+	def draw_legend(self, cr):
+		''' the names of the series in their colors, top right, when there is more than one '''
+		if len(self.series) < 2:
+			return
+		cr.select_font_face("Arial", cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
+		cr.set_font_size(12)
+		y = 5
+		for series in self.series:
+			_, _, text_width, text_height = cr.text_extents(series.name)[:4]
+			y += text_height + 4
+			cr.set_source_rgb(*self.hex_to_rgb(series.line_color))
+			cr.move_to(self.width - text_width - 10, y)
+			cr.show_text(series.name)
+
+	def draw_ticks(self, cr):
+		# Draw Y-axis tick marks and labels
+		span = self.max_value - self.min_value
+		if self.tick_step:
+			# autoscaled, a tick on each round step
+			num_ticks = int(round(span / self.tick_step)) + 1
+			step = self.tick_step
+			label_format = "{:.%df}" % max(0, -math.floor(math.log10(step)))
+		else:
+			num_ticks = 5
+			step = span / (num_ticks - 1)
+			label_format = "{:.1f}"
+		tick_spacing = (self.height - 10) / max(num_ticks - 1, 1)  # Adjusted spacing
+		cr.set_source_rgb(*self.hex_to_rgb(self.legend_color))
+		cr.set_line_width(self.line_width)
+		cr.select_font_face("Arial", cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
+		cr.set_font_size(14)
 		for i in range(num_ticks):
 			y = self.height - i * tick_spacing - 5  # Adjusted y position
 			cr.move_to(0, y)
@@ -78,48 +515,67 @@ class LiveChart(Gtk.Box):
 			cr.stroke()
 
 			# Calculate tick label value
-			value = self.min_value + i * (self.max_value - self.min_value) / (num_ticks - 1)
+			value = self.min_value + i * step
 			# Display tick label
-			label = "{:.1f}".format(value)
-			cr.set_source_rgb(*self.hex_to_rgb(self.legend_color))
-			cr.select_font_face("Arial", cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
-			cr.set_font_size(14)
+			label = label_format.format(value)
 			_, text_width, text_height = cr.text_extents(label)[:3]
 			if i == 0:  # Adjust position for top label
 				y -= text_height
 			cr.move_to(15, y + text_height / 2)  # Adjusted y position for label
 			cr.show_text(label)
 
-
 	def hex_to_rgb(self, hex_color):
-		hex_color = hex_color.lstrip('#')
-		return tuple(int(hex_color[i:i+2], 16) / 255 for i in (0, 2, 4))
+		return hex_to_rgb(hex_color)
 
 
 	def set_scale(self,min_value=None,max_value=None,relative_scale=-1):
-		scale = 'unused'
+		'''
+		set the fixed scale of the first series. relative_scale True fits
+		the scale to the data instead, False goes back to the fixed scale
+		and -1 leaves it as it is.
+		'''
 		if min_value != None and max_value != None:
 			debug(f'min_value={min_value},max_value={max_value}')
 		if relative_scale != -1:
-			pass
+			self.relative_scale = relative_scale
 		if min_value != None:
-			self.min_value = min_value
-			debug('new min',self.min_value)
-
+			self.fixed_min = min_value
 		if max_value != None:
-			self.max_value = max_value
-			debug('new max',self.max_value)
+			self.fixed_max = max_value
 
 		if self.relative_scale:
-			if len(self.data) >1:
-				mnv = min(self.data)
-				mnv -= (mnv*1.25)
-				mxv = max(self.data) 
-				mxv += (mxv*1.25)
-				scale = (mxv - mnv)
+			self.autoscale()
+		else:
+			self.tick_step = None
+			self.min_value = self.fixed_min
+			self.max_value = self.fixed_max
 
 		self.queue_draw()
 
+	def autoscale(self):
+		'''
+		fit the scale of the first series to its data, with round ends and
+		ticks. The scale grows as soon as a sample falls outside it but only
+		shrinks once the data uses less than shrink of it, so the axis does
+		not move with every sample. The buffer keeps its minimum and
+		maximum up to date, so this is O(1). Returns True if the scale
+		changed.
+		'''
+		low, high = self.data.min(), self.data.max()
+		if low is None:
+			return False
+		span = self.max_value - self.min_value
+		if (self.tick_step and self.min_value <= low and high <= self.max_value
+				and high - low >= span * self.shrink):
+			return False
+		margin = (high - low) * 0.05
+		scale = nice_scale(low - margin, high + margin)
+		if scale == (self.min_value, self.max_value, self.tick_step):
+			return False
+		self.min_value, self.max_value, self.tick_step = scale
+		debug(f'autoscale {scale}')
+		return True
+
 	def set_min_value(self,min_value):
 		self.set_scale(min_value,None)
 
@@ -130,8 +586,24 @@ class LiveChart(Gtk.Box):
 		self.line_width = value
 		self.queue_draw()
 
-	def set_data(self, data):
-		self.data = data
+	def set_data(self, data, index=0):
+		'''
+		data for the series at index, a RingBuffer is used as it is and
+		shared with the caller, anything else is copied into one. With a
+		time_window data is (timestamp, value) pairs.
+		'''
+		if not isinstance(data, RingBuffer):
+			buffer = RingBuffer(max(self.capacity, len(data), 1), timestamps=bool(self.time_window))
+			if self.time_window:
+				buffer.extend([v for t, v in data], [t for t, v in data])
+			else:
+				buffer.extend(data)
+			data = buffer
+		self.series[index].data = data
+		if self.scrolling:
+			if index == 0:
+				self.capacity = data.capacity
+			self.line_surface = None
 		self.set_scale(None,None)
 
 if __name__ == "__main__":
@@ -156,11 +628,7 @@ if __name__ == "__main__":
 	win.show_all()
 
 	def update_chart():
-		global data
-		data.append(sensor.read()['usage'])
-		if len(data) > 50:
-			data = data[:-50]
-		live_chart.set_data(data)  # Update data with random values
+		live_chart.append(sensor.read()['usage'])
 		return True
 
 	# Update the chart every 1000 milliseconds (1 second)
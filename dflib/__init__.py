@@ -1,10 +1,15 @@
 '''
 A set of tools to help run this mess.
 Modules to import are:
+	bgio: Background I/O for Gtk programs
 	cfgjson: JSON based configuration
 	debug: Debugging tools
 	rest: RESTApi tools
+	ringbuffer: NumPy ring buffer for chart data
+	shmstore: Memory mapped sensor snapshot store
+	snapshot: Atomic sensor data files
 	theme: Gtk theme tools
+	watch: File change notification
 	widgets: Enhanced Gtk Widgets
 '''
 from enum import IntFlag
@@ -0,0 +1,109 @@
+'''
+Background I/O for Gtk programs.
+Blocking work, reading sensors or talking to the RestAPI, is run on a pool
+of worker threads and the result is handed back to the Gtk main loop with
+GLib.idle_add, so a slow host never freezes the UI. Work is submitted on
+behalf of an owner, usually a window; cancelling the owner when the window
+closes drops its pending work and any results still on their way.
+'''
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from gi.repository import GLib
+from dflib.debug import debug, error
+
+class Task:
+	'''
+	A unit of background work. cancel() stops it from starting if it has
+	not, and stops its callbacks from being called if it has.
+	'''
+	def __init__(self,owner):
+		self.owner = owner
+		self.cancelled = False
+		self.future = None
+
+	def cancel(self):
+		self.cancelled = True
+		if self.future:
+			self.future.cancel()
+
+class BackgroundIO:
+	'''
+	Run functions on a pool of max_workers threads and deliver results on
+	the main loop.
+	'''
+	def __init__(self,max_workers=4):
+		self.executor = ThreadPoolExecutor(max_workers=max_workers,thread_name_prefix='bgio')
+		self._lock = threading.Lock()
+		self._owners = {}
+
+	def submit(self,func,*args,callback=None,on_error=None,owner=None):
+		'''
+		run func(*args) on a worker. callback(result) is called on the main
+		loop when it returns, on_error(exception) if it raises. Returns
+		a Task.
+		'''
+		task = Task(owner)
+		if owner is not None:
+			with self._lock:
+				self._owners.setdefault(id(owner),set()).add(task)
+
+		def done(future):
+			if future.cancelled():
+				self._forget(task)
+				return
+			exception = future.exception()
+			GLib.idle_add(self._deliver,task,callback,on_error,future.result() if not exception else None,exception)
+
+		task.future = self.executor.submit(self._run,task,func,args)
+		task.future.add_done_callback(done)
+		return task
+
+	def _run(self,task,func,args):
+		if task.cancelled:
+			return None
+		return func(*args)
+
+	def _deliver(self,task,callback,on_error,result,exception):
+		''' runs on the main loop '''
+		self._forget(task)
+		if task.cancelled:
+			return False
+		if exception:
+			if callable(on_error):
+				on_error(exception)
+			else:
+				error(f'background task failed: {exception}')
+		elif callable(callback):
+			callback(result)
+		return False
+
+	def _forget(self,task):
+		if task.owner is None:
+			return
+		with self._lock:
+			tasks = self._owners.get(id(task.owner))
+			if tasks:
+				tasks.discard(task)
+				if not tasks:
+					del self._owners[id(task.owner)]
+
+	def cancel_owner(self,owner):
+		''' cancel all work submitted for owner '''
+		with self._lock:
+			tasks = self._owners.pop(id(owner),set())
+		for task in tasks:
+			task.cancel()
+		if tasks:
+			debug(f'cancelled {len(tasks)} tasks')
+
+	def shutdown(self):
+		self.executor.shutdown(wait=False,cancel_futures=True)
+
+_bgio = None
+
+def get_bgio(**kwargs):
+	''' the process wide BackgroundIO, created with kwargs on first use '''
+	global _bgio
+	if not _bgio:
+		_bgio = BackgroundIO(**kwargs)
+	return _bgio
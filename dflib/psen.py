@@ -1,13 +1,30 @@
 import os
 import sys
 import json
-import time
 
 
 stats = {
-	'reads': 0
+	'reads': 0,
+	'partial': 0
 }
 
+default_store = None
+''' ShmStore read by every PsuedoSensor that is not given its own store '''
+
+def use_store(path):
+	'''
+	read sensor data from the snapshot store at path when it has the sensor.
+	Returns False if path is not a usable store.
+	'''
+	global default_store
+	from dflib.shmstore import ShmStore
+	try:
+		default_store = ShmStore(path)
+	except (OSError,ValueError):
+		default_store = None
+		return False
+	return True
+
 class PsuedoSensor:
 	'''
 	Since the data collection is done by a daemon process, this class provides 
@@ -17,26 +34,34 @@ class PsuedoSensor:
 		self.sensor = None
 		self.host = None
 		self.base_path = None
+		self.store = None
+		self.last = None
 		for k,v in kwargs.items():
 			setattr(self,k,v)
 
-	def read(self):
+	def path(self):
+		''' path of the file this sensor's data is read from '''
+		return os.path.join(self.base_path,f'{self.host}/{self.sensor}/{self.sensor}.json')
+
+	def read(self,tries=3):
 		'''
-		read data, allowing for race conditions on sensor files
+		read data. If a snapshot store holds this sensor it is read from there,
+		otherwise from the sensor file. The sensorfs files are written in
+		place by the sensor server, so a read can catch one half written. It
+		is read again straight away up to tries times, then the last good
+		reading is returned, None if there has not been one.
 		'''
 		stats['reads'] += 1
-		tries = 0
-		dpath = os.path.join(self.base_path,f'{self.host}/{self.sensor}/{self.sensor}.json')
-		data = None
-		while not data:
+		store = self.store or default_store
+		if store:
+			data = store.get(self.host,self.sensor)
+			if data is not None:
+				return data
+		for attempt in range(tries):
 			try:
-				with open(dpath) as f:
-					data = json.load(f)
+				with open(self.path()) as f:
+					self.last = json.load(f)
+				return self.last
 			except json.decoder.JSONDecodeError:
-				tries += 1
-				data = None
-				time.sleep(.3)
-				if tries > 5:
-					return None
-		return data
-			
+				stats['partial'] += 1
+		return self.last
@@ -1,21 +1,189 @@
 import os
 import sys
+import time
+import threading
 import requests
-import subprocess
 import pprint
-
-def _ping(host='8.8.8.8'):
-   try:
-      subprocess.check_output(["ping", "-c", "1", host])
-      return True
-   except subprocess.CalledProcessError:
-      return False
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dflib.debug import debug
 
 stats = {
 	'sent': 0,
 	'errors': 0
 }
 
+port = 4242
+''' the port RestAPI servers listen on '''
+
+class SessionRegistry(object):
+	'''
+	Keep-alive HTTP sessions shared by every RestClient, one per server.
+	Each session has a connection pool of pool_size connections, retries 
+	failed connects with exponential backoff and is closed after it has 
+	been idle for idle_timeout seconds.
+	'''
+	def __init__(self,**kwargs):
+		self.pool_size = 4
+		self.idle_timeout = 60
+		self.retries = 2
+		self.backoff = 0.2
+		self._sessions = {}
+		self._lock = threading.Lock()
+		self.configure(**kwargs)
+
+	def configure(self,**kwargs):
+		'''
+		set any of pool_size, idle_timeout, retries and backoff. Sessions 
+		already open are closed so the new settings take effect.
+		'''
+		for k,v in kwargs.items():
+			if k in ['pool_size','idle_timeout','retries','backoff']:
+				setattr(self,k,v)
+			else:
+				raise ValueError(f'Invalid keyword argument {k}')
+		if kwargs:
+			self.close()
+
+	def _new_session(self):
+		''' build a session with our pool and retry policy '''
+		retry = Retry(
+			total=self.retries,
+			connect=self.retries,
+			# re-raise read timeouts as they are, not as connection errors
+			read=False,
+			backoff_factor=self.backoff,
+			status_forcelist=(502,503,504),
+			allowed_methods=frozenset(['GET']))
+		adapter = HTTPAdapter(
+			pool_connections=1,
+			pool_maxsize=self.pool_size,
+			max_retries=retry)
+		session = requests.Session()
+		session.mount('http://',adapter)
+		session.headers.update({'Accept': 'application/json'})
+		return session
+
+	def get(self,server):
+		'''
+		get the session for server, creating it if needed. Sessions for other
+		servers that have sat idle too long are closed on the way.
+		'''
+		now = time.monotonic()
+		with self._lock:
+			for s in list(self._sessions.keys()):
+				session, last_used = self._sessions[s]
+				if s != server and now - last_used > self.idle_timeout:
+					session.close()
+					del self._sessions[s]
+			if server in self._sessions:
+				session = self._sessions[server][0]
+			else:
+				session = self._new_session()
+			self._sessions[server] = [session,now]
+			return session
+
+	def close(self):
+		''' close all sessions '''
+		with self._lock:
+			for session, last_used in self._sessions.values():
+				session.close()
+			self._sessions = {}
+
+sessions = SessionRegistry()
+
+class HostHealth(object):
+	'''
+	Track whether servers are reachable from the outcome of real requests.
+	A server is up until a request to it fails to connect. Once down, 
+	requests to it fail fast until a probe is due; the probe is simply the
+	next real request, sent with a short connect timeout. Only failing to
+	connect counts, a server that is slow to answer is still up. Each failed
+	probe doubles the wait before the next one, up to max_backoff. A known
+	state is only trusted for ttl seconds, after that the server is unknown
+	again.
+	'''
+	def __init__(self,ttl=30,backoff=1,max_backoff=60,probe_timeout=2):
+		self.ttl = ttl
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self.probe_timeout = probe_timeout
+		self._hosts = {}
+		self._lock = threading.Lock()
+
+	def state(self,server):
+		''' return 'up', 'down' or 'unknown' for server '''
+		with self._lock:
+			entry = self._hosts.get(server)
+			if not entry or time.monotonic() - entry['checked'] > self.ttl:
+				return 'unknown'
+			return 'up' if entry['up'] else 'down'
+
+	def allow(self,server):
+		'''
+		return whether a request to server should be sent. For a down server 
+		only one caller is let through per backoff period, as the probe.
+		'''
+		now = time.monotonic()
+		with self._lock:
+			entry = self._hosts.get(server)
+			if not entry or entry['up']:
+				return True
+			if now >= entry['next_probe']:
+				entry['next_probe'] = now + entry['delay']
+				return True
+			return False
+
+	def timeout(self,server,timeout):
+		'''
+		the timeout to use for a request. Unless server is known up it is a
+		(connect, read) pair with a short connect timeout, the read timeout
+		is left alone so slow sensors still get their answer.
+		'''
+		if self.state(server) == 'up':
+			return timeout
+		return (min(timeout,self.probe_timeout),timeout)
+
+	def success(self,server):
+		''' record that a request to server got an answer '''
+		with self._lock:
+			self._hosts[server] = {
+				'up': True,
+				'checked': time.monotonic(),
+				'delay': self.backoff,
+				'next_probe': 0
+			}
+
+	def failure(self,server):
+		''' record that a request to server could not connect '''
+		now = time.monotonic()
+		with self._lock:
+			entry = self._hosts.get(server)
+			if entry and not entry['up']:
+				delay = min(entry['delay']*2,self.max_backoff)
+			else:
+				delay = self.backoff
+			self._hosts[server] = {
+				'up': False,
+				'checked': now,
+				'delay': delay,
+				'next_probe': now + delay
+			}
+
+health = HostHealth()
+
+batch_support = {}
+''' server -> whether it has the readmany endpoint, absent until we know '''
+
+def batch_supported(server):
+	''' True or False if we know whether server can batch reads, otherwise None '''
+	return batch_support.get(server)
+
+def configure_sessions(**kwargs):
+	''' configure the shared session registry, see SessionRegistry.configure '''
+	sessions.configure(**kwargs)
+
 class RestClient(object):
 	'''
 	This is the improved RESTapi interface as an class.
@@ -26,6 +194,10 @@ class RestClient(object):
 		self.server = None
 		self.host = None
 		self.sensor = None
+		self.timeout = 10
+		self.last_status = None
+		self.sessions = sessions
+		self.health = health
 
 		for k in ['server','host','sensor']:
 			if not k in kwargs:
@@ -39,10 +211,11 @@ class RestClient(object):
 
 	def setup(self,**kwargs):
 		'''
-		set new options in kwargs for server, host and sensor. Any or all
-		may be specified.
+		set new options in kwargs for server, host, sensor, timeout, sessions
+		and health. Any or all may be specified. sessions is a SessionRegistry 
+		and health a HostHealth to use instead of the shared ones.
 		'''
-		for k in ['server','host','sensor']:
+		for k in ['server','host','sensor','timeout','sessions','health']:
 			if k in kwargs:
 				setattr(self,k,kwargs[k])
 
@@ -63,16 +236,29 @@ class RestClient(object):
 		Send a formatted command to the server, return the response, or
 		return None on error. detailedError is called on exceptions.
 		command contains the url encoded command and parameters. These are sent
-		to server on port 4242.
+		to server on port. The HTTP status of the response is kept in 
+		last_status.
 		"""
-		if not _ping(self.server):
+		self.last_status = None
+		if not self.health.allow(self.server):
 			stats['errors'] += 1
 			return {'error': 'host unreachable'}
-		headers = {'Accept': 'application/json'}
-		url = f'http://{self.server}:4242/{command}'
+		url = f'http://{self.server}:{port}/{command}'
+		timeout = self.health.timeout(self.server,self.timeout)
 		try:
-			r = requests.get(url=url, headers=headers,timeout=10)
+			try:
+				r = self.sessions.get(self.server).get(url=url,timeout=timeout)
+			except requests.exceptions.ConnectionError:
+				# includes ConnectTimeout
+				self.health.failure(self.server)
+				raise
+			except requests.exceptions.ReadTimeout:
+				# it accepted the connection, so it is there, just slow
+				self.health.success(self.server)
+				raise
+			self.health.success(self.server)
 			stats['sent'] += 1
+			self.last_status = r.status_code
 			js = r.json()
 			if 'error' in js:
 				stats['errors'] += 1
@@ -80,7 +266,7 @@ class RestClient(object):
 		except Exception as e:
 			stats['errors'] += 1
 			return {'error': e}
-		return r.json()
+		return js
 
 
 	def read(self):
@@ -89,6 +275,55 @@ class RestClient(object):
 		"""
 		return self._sendCommand(f'read?host={self.host}&sensor={self.sensor}')
 
+	def read_many(self,pairs):
+		"""
+		get sensor data for a list of (host, sensor) pairs in one request.
+		Returns a dict keyed by (host, sensor). If the server does not have 
+		the readmany endpoint the pairs are read individually, concurrently, 
+		over the shared session instead and the server is remembered as 
+		not supporting it.
+		"""
+		pairs = list(dict.fromkeys(pairs))
+		if not pairs:
+			return {}
+		if batch_supported(self.server) != False:
+			spec = ','.join([f'{host}/{sensor}' for host, sensor in pairs])
+			js = self._sendCommand(f'readmany?sensors={spec}')
+			if self.last_status is None:
+				return {pair: js for pair in pairs}
+			if self.last_status == 200 and type(js) is dict and not 'error' in js:
+				batch_support[self.server] = True
+				result = {}
+				for host, sensor in pairs:
+					data = js.get(f'{host}/{sensor}')
+					if data is None:
+						data = {'error': 'no data returned'}
+					result[(host,sensor)] = data
+				return result
+			# a 200 with an error is the batch failing, not a missing endpoint
+			if self.last_status in (400,404,405,501):
+				debug(f'{self.server} has no readmany endpoint, reading individually')
+				batch_support[self.server] = False
+		return self._read_individually(pairs)
+
+	def _read_individually(self,pairs):
+		"""
+		fallback for read_many: one read per pair, run concurrently so they
+		share the session's pool of keep-alive connections
+		"""
+		def read_one(pair):
+			client = RestClient(
+				server=self.server,
+				host=pair[0],
+				sensor=pair[1],
+				timeout=self.timeout,
+				sessions=self.sessions,
+				health=self.health)
+			return client.read()
+		workers = max(1,min(len(pairs),self.sessions.pool_size))
+		with ThreadPoolExecutor(max_workers=workers) as executor:
+			return dict(zip(pairs,executor.map(read_one,pairs)))
+
 	def write(self,data):
 		"""
 		write sensor data to host as json object
@@ -0,0 +1,148 @@
+'''
+Fixed size ring buffer of samples for charts.
+The samples live in a preallocated numpy array twice the capacity long and
+each one is written twice, at i and i + capacity, so the samples in order
+are always one contiguous slice of the array. values() returns that slice
+as a view, without copying, and a renderer can use it as it is. Appending
+is O(1); the mean is kept as a running sum and the minimum and maximum
+with monotonic deques, so all three cost O(1) per sample to keep up.
+Timestamps can be stored alongside the values.
+'''
+import math
+from collections import deque
+import numpy as np
+
+class RingBuffer:
+	'''
+	The last capacity samples, oldest first. Set timestamps=True to keep
+	a time for each sample.
+	'''
+	def __init__(self,capacity,dtype=float,timestamps=False):
+		if capacity < 1:
+			raise ValueError('capacity must be at least 1')
+		self.capacity = capacity
+		self._values = np.zeros(2*capacity,dtype=dtype)
+		self._times = np.zeros(2*capacity,dtype=float) if timestamps else None
+		self._start = 0
+		self._len = 0
+		self._sum = 0.0
+		self._counted = 0
+		self._appends = 0
+		# (sequence, value) with values increasing for _lows, decreasing
+		# for _highs; the head of each is the extreme of the window
+		self._seq = 0
+		self._lows = deque()
+		self._highs = deque()
+
+	@property
+	def timestamps(self):
+		return self._times is not None
+
+	@property
+	def full(self):
+		return self._len == self.capacity
+
+	def __len__(self):
+		return self._len
+
+	def __iter__(self):
+		return iter(self.values())
+
+	def __getitem__(self,index):
+		return self.values()[index]
+
+	def __array__(self,dtype=None,copy=None):
+		if dtype is None:
+			return self.values()
+		return self.values().astype(dtype,copy=False)
+
+	def _count(self,value,sign):
+		if not math.isnan(value):
+			self._sum += sign*value
+			self._counted += sign
+
+	def append(self,value,timestamp=None):
+		''' add a sample, dropping the oldest when full '''
+		value = float(value)
+		if self._len == self.capacity:
+			self._count(float(self._values[self._start]),-1)
+			self._start = (self._start + 1) % self.capacity
+		else:
+			self._len += 1
+		i = (self._start + self._len - 1) % self.capacity
+		self._values[i] = self._values[i + self.capacity] = value
+		if self._times is not None:
+			self._times[i] = self._times[i + self.capacity] = timestamp if timestamp is not None else np.nan
+		self._count(value,1)
+		self._extremes(value)
+		self._appends += 1
+		if self._appends >= self.capacity:
+			# stop rounding errors building up in the running sum
+			self._resum()
+
+	def _extremes(self,value):
+		''' slide the min and max windows on by one sample '''
+		self._seq += 1
+		oldest = self._seq - self.capacity
+		for window in (self._lows,self._highs):
+			while window and window[0][0] <= oldest:
+				window.popleft()
+		if math.isnan(value):
+			return
+		while self._lows and self._lows[-1][1] >= value:
+			self._lows.pop()
+		self._lows.append((self._seq,value))
+		while self._highs and self._highs[-1][1] <= value:
+			self._highs.pop()
+		self._highs.append((self._seq,value))
+
+	def extend(self,values,timestamps=None):
+		''' append each of values, with the matching timestamp if given '''
+		if timestamps is None:
+			for value in values:
+				self.append(value)
+		else:
+			for value, timestamp in zip(values,timestamps):
+				self.append(value,timestamp)
+
+	def clear(self):
+		self._start = 0
+		self._len = 0
+		self._lows.clear()
+		self._highs.clear()
+		self._resum()
+
+	def _resum(self):
+		self._appends = 0
+		values = self.values()
+		finite = values[~np.isnan(values)]
+		self._sum = float(finite.sum())
+		self._counted = len(finite)
+
+	def values(self):
+		''' the samples, oldest first, as a view into the buffer '''
+		return self._values[self._start:self._start + self._len]
+
+	def times(self):
+		''' the timestamps of the samples as a view, None if there are none '''
+		if self._times is None:
+			return None
+		return self._times[self._start:self._start + self._len]
+
+	def min(self):
+		''' the smallest sample, None when empty '''
+		if not self._lows:
+			return None
+		return self._lows[0][1]
+
+	def max(self):
+		''' the largest sample, None when empty '''
+		if not self._highs:
+			return None
+		return self._highs[0][1]
+
+	def mean(self):
+		''' the mean of the samples, None when empty '''
+		if not self._counted:
+			return None
+		return self._sum / self._counted
@@ -0,0 +1,275 @@
+'''
+Memory mapped sensor snapshot store.
+The collector keeps the latest reading for every sensor in one file that is
+mapped into memory by the collector and every reader. The file is a header
+followed by a fixed number of fixed size slots, one per sensor:
+
+	header:	magic(8) version(4) nslots(4) slot_size(4) padding
+	slot:	seq(8) key_len(2) key(62) length(4) padding(4) payload
+
+The slot keys, 'host/sensor', are the directory index. Each slot is guarded
+by a sequence counter used as a seqlock: the writer makes it odd, writes the
+payload and makes it even again. A reader copies the payload between two
+reads of the counter and retries if the counter was odd or has moved, so
+it never sees a half written record. Payloads are compact JSON and readers
+only parse a slot again when its counter has changed.
+
+Run as a script to dump the contents of a store.
+'''
+import os
+import sys
+import json
+import mmap
+import struct
+import threading
+import time
+
+MAGIC = b'SENSHM01'
+VERSION = 1
+_header = struct.Struct('<8sIII')
+_slot_header = struct.Struct('<QH62sI4x')
+HEADER_SIZE = 64
+KEY_SIZE = 62
+
+stats = {
+	'reads': 0,
+	'parses': 0,
+	'retries': 0,
+	'writes': 0
+}
+
+def _key(host,sensor):
+	return f'{host}/{sensor}'
+
+class ShmStore:
+	'''
+	A snapshot store in the file path. With create=True the file is created
+	(or an existing store is reopened) for writing, with nslots slots of
+	slot_size bytes each. Otherwise the store is opened read only and its
+	geometry is taken from the header.
+	'''
+	def __init__(self,path,create=False,nslots=128,slot_size=2048):
+		self.path = path
+		self.writable = create
+		self._lock = threading.Lock()
+		self._index = {}
+		self._cache = {}
+		if create:
+			size = HEADER_SIZE + nslots*slot_size
+			if not (os.path.exists(path) and self._geometry(path) == (nslots,slot_size)):
+				# a new file renamed into place, readers with the old one
+				# mapped keep it rather than having it cut from under them
+				tmp = f'{path}.{os.getpid()}.tmp'
+				fd = os.open(tmp,os.O_RDWR|os.O_CREAT|os.O_TRUNC,0o644)
+				try:
+					os.ftruncate(fd,size)
+					os.pwrite(fd,_header.pack(MAGIC,VERSION,nslots,slot_size),0)
+				except BaseException:
+					os.close(fd)
+					os.unlink(tmp)
+					raise
+				os.close(fd)
+				os.replace(tmp,path)
+			fd = os.open(path,os.O_RDWR)
+			try:
+				self._map = mmap.mmap(fd,size,access=mmap.ACCESS_WRITE)
+			finally:
+				os.close(fd)
+		else:
+			geometry = self._geometry(path)
+			if not geometry:
+				raise ValueError(f'{path} is not a sensor snapshot store')
+			nslots, slot_size = geometry
+			with open(path,'rb') as f:
+				self._map = mmap.mmap(f.fileno(),HEADER_SIZE + nslots*slot_size,access=mmap.ACCESS_READ)
+		self.nslots = nslots
+		self.slot_size = slot_size
+		self.capacity = slot_size - _slot_header.size
+		self._view = memoryview(self._map)
+		self._scan()
+
+	@staticmethod
+	def _geometry(path):
+		''' read (nslots, slot_size) from the header of path, None if it is not a store '''
+		try:
+			with open(path,'rb') as f:
+				header = f.read(_header.size)
+		except OSError:
+			return None
+		if len(header) != _header.size:
+			return None
+		magic, version, nslots, slot_size = _header.unpack(header)
+		if magic != MAGIC or version != VERSION:
+			return None
+		return (nslots,slot_size)
+
+	def _offset(self,slot):
+		return HEADER_SIZE + slot*self.slot_size
+
+	def _slot_key(self,slot):
+		''' the key in slot, None if the slot is free '''
+		seq, key_len, key, length = _slot_header.unpack_from(self._map,self._offset(slot))
+		if not key_len:
+			return None
+		return key[:key_len].decode('utf-8')
+
+	def _scan(self):
+		''' rebuild the key -> slot index from the slot headers '''
+		index = {}
+		for slot in range(self.nslots):
+			key = self._slot_key(slot)
+			if key:
+				index[key] = slot
+		self._index = index
+
+	def keys(self):
+		''' list of (host, sensor) in the store '''
+		self._scan()
+		return [tuple(key.split('/',1)) for key in self._index.keys()]
+
+	def _seq(self,offset):
+		return struct.unpack_from('<Q',self._map,offset)[0]
+
+	def put(self,host,sensor,data):
+		'''
+		store data for host/sensor, claiming a slot for it if it has none.
+		Returns False if the stored payload was already the same.
+		'''
+		if not self.writable:
+			raise PermissionError(f'{self.path} is open read only')
+		key = _key(host,sensor)
+		kbytes = key.encode('utf-8')
+		if len(kbytes) > KEY_SIZE:
+			raise ValueError(f'key {key} is too long')
+		payload = json.dumps(data,separators=(',',':')).encode('utf-8')
+		if len(payload) > self.capacity:
+			raise ValueError(f'{key}: {len(payload)} bytes does not fit in a {self.capacity} byte slot')
+		with self._lock:
+			slot = self._index.get(key)
+			if slot is None:
+				slot = self._free_slot()
+				self._index[key] = slot
+			offset = self._offset(slot)
+			start = offset + _slot_header.size
+			seq, key_len, old_key, length = _slot_header.unpack_from(self._map,offset)
+			if key_len and length == len(payload) and self._map[start:start+length] == payload:
+				return False
+			if seq & 1:
+				seq += 1
+			struct.pack_into('<Q',self._map,offset,seq+1)
+			self._map[start:start+len(payload)] = payload
+			_slot_header.pack_into(self._map,offset,seq+1,len(kbytes),kbytes,len(payload))
+			struct.pack_into('<Q',self._map,offset,seq+2)
+			stats['writes'] += 1
+		return True
+
+	def _free_slot(self):
+		for slot in range(self.nslots):
+			if self._slot_key(slot) is None:
+				return slot
+		raise MemoryError(f'{self.path}: all {self.nslots} slots are in use')
+
+	def delete(self,host,sensor):
+		''' free the slot for host/sensor '''
+		if not self.writable:
+			raise PermissionError(f'{self.path} is open read only')
+		key = _key(host,sensor)
+		with self._lock:
+			slot = self._index.pop(key,None)
+			if slot is None:
+				return
+			offset = self._offset(slot)
+			seq = self._seq(offset)
+			if seq & 1:
+				seq += 1
+			struct.pack_into('<Q',self._map,offset,seq+1)
+			_slot_header.pack_into(self._map,offset,seq+1,0,b'',0)
+			struct.pack_into('<Q',self._map,offset,seq+2)
+
+	def seq(self,host,sensor):
+		''' the sequence counter for host/sensor, None if it is not in the store '''
+		slot = self._lookup(_key(host,sensor))
+		if slot is None:
+			return None
+		return self._seq(self._offset(slot))
+
+	def _lookup(self,key):
+		slot = self._index.get(key)
+		if slot is None or self._slot_key(slot) != key:
+			self._scan()
+			slot = self._index.get(key)
+		return slot
+
+	def get(self,host,sensor,tries=100):
+		'''
+		return the data for host/sensor, None if it is not in the store.
+		A fresh dict is returned each time but the payload is only parsed
+		when it has changed since the last get.
+		'''
+		stats['reads'] += 1
+		key = _key(host,sensor)
+		slot = self._lookup(key)
+		if slot is None:
+			return None
+		offset = self._offset(slot)
+		start = offset + _slot_header.size
+		for attempt in range(tries):
+			seq = self._seq(offset)
+			if seq & 1:
+				stats['retries'] += 1
+				time.sleep(0)
+				continue
+			cached = self._cache.get(key)
+			if cached and cached[0] == seq:
+				return dict(cached[1])
+			s, key_len, skey, length = _slot_header.unpack_from(self._map,offset)
+			payload = bytes(self._view[start:start+length])
+			if self._seq(offset) != seq:
+				stats['retries'] += 1
+				continue
+			if skey[:key_len].decode('utf-8') != key:
+				self._cache.pop(key,None)
+				self._scan()
+				return None
+			stats['parses'] += 1
+			data = json.loads(payload)
+			self._cache[key] = (seq,data)
+			return dict(data)
+		return None
+
+	def close(self):
+		self._view.release()
+		self._map.close()
+
+class ShmSensor:
+	'''
+	Drop in for PsuedoSensor.read() reading host/sensor from a ShmStore
+	'''
+	def __init__(self,store,host,sensor):
+		self.store = store
+		self.host = host
+		self.sensor = sensor
+
+	def read(self):
+		return self.store.get(self.host,self.sensor)
+
+if __name__ == "__main__":
+	import argparse
+	parser = argparse.ArgumentParser(
+			prog="shmstore",
+			description="dump a sensor snapshot store"
+		)
+	parser.add_argument('path',type=str,help='snapshot store file')
+	parser.add_argument('-k','--key',type=str,default=None,metavar='host/sensor',help='only dump this sensor')
+	parser.add_argument('-w','--watch',type=float,default=0,metavar='secs',help='dump again every secs seconds')
+	args = parser.parse_args()
+	store = ShmStore(args.path)
+	print(f'{args.path}: {store.nslots} slots of {store.slot_size} bytes',file=sys.stderr)
+	while True:
+		for host, sensor in store.keys():
+			if args.key and args.key != _key(host,sensor):
+				continue
+			print(json.dumps({'key': _key(host,sensor), 'seq': store.seq(host,sensor), 'data': store.get(host,sensor)}))
+		if not args.watch:
+			break
+		time.sleep(args.watch)
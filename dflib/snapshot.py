@@ -0,0 +1,136 @@
+'''
+Atomic snapshot files for sensor data.
+A snapshot is written to a temporary file in the same directory and renamed
+into place, so a reader sees either the old file or the new one and never a
+partial write. Payloads are compact JSON, or pickle when a binary format is
+wanted, and a write is skipped when the payload has not changed since the 
+last write to that file.
+'''
+import os
+import json
+import pickle
+import tempfile
+import threading
+
+_umask = None
+
+def _get_umask():
+	'''
+	the process umask, read once on first use. /proc has it without
+	changing it, elsewhere it is set and put back straight away.
+	'''
+	global _umask
+	if _umask is None:
+		try:
+			with open('/proc/self/status') as f:
+				for line in f:
+					if line.startswith('Umask:'):
+						_umask = int(line.split()[1],8)
+		except (OSError,ValueError):
+			pass
+		if _umask is None:
+			_umask = os.umask(0o022)
+			os.umask(_umask)
+	return _umask
+
+formats = {
+	'json': '.json',
+	'pickle': '.pickle'
+}
+
+def encode(data,fmt='json'):
+	''' encode data as bytes in fmt '''
+	if fmt == 'json':
+		return json.dumps(data,separators=(',',':')).encode('utf-8')
+	if fmt == 'pickle':
+		return pickle.dumps(data,protocol=pickle.HIGHEST_PROTOCOL)
+	raise ValueError(f'Unknown snapshot format {fmt}')
+
+def decode(payload,fmt='json'):
+	''' decode bytes in fmt '''
+	if fmt == 'json':
+		return json.loads(payload)
+	if fmt == 'pickle':
+		return pickle.loads(payload)
+	raise ValueError(f'Unknown snapshot format {fmt}')
+
+def write_atomic(path,payload):
+	'''
+	write bytes to path through a temporary file and a rename. The file
+	keeps the mode it had, a new one gets 0666 less the umask.
+	'''
+	dirname, basename = os.path.split(path)
+	try:
+		mode = os.stat(path).st_mode & 0o7777
+	except FileNotFoundError:
+		# mkstemp makes files only the owner can read, snapshots get the usual mode
+		mode = 0o666 & ~_get_umask()
+	fd, tmp = tempfile.mkstemp(dir=dirname or '.',prefix=f'.{basename}.',suffix='.tmp')
+	try:
+		with os.fdopen(fd,'wb') as f:
+			os.fchmod(f.fileno(),mode)
+			f.write(payload)
+		os.replace(tmp,path)
+	except BaseException:
+		os.unlink(tmp)
+		raise
+
+class SnapshotWriter:
+	'''
+	Write snapshots named {name}{extension} into base_dir. The last payload
+	written for each name is remembered so unchanged data costs no write.
+	'''
+	def __init__(self,base_dir,fmt='json'):
+		if not fmt in formats:
+			raise ValueError(f'Unknown snapshot format {fmt}')
+		self.base_dir = base_dir
+		self.fmt = fmt
+		self._last = {}
+		self._lock = threading.Lock()
+		self.stats = {
+			'writes': 0,
+			'skipped': 0
+		}
+
+	def path(self,name):
+		''' full path of the snapshot for name '''
+		return os.path.join(self.base_dir,f'{name}{formats[self.fmt]}')
+
+	def write(self,name,data):
+		'''
+		write data as the snapshot for name. Returns True if the file was 
+		written, False if it was already up to date.
+		'''
+		payload = encode(data,self.fmt)
+		path = self.path(name)
+		with self._lock:
+			if self._last.get(name) == payload and os.path.exists(path):
+				self.stats['skipped'] += 1
+				return False
+		write_atomic(path,payload)
+		with self._lock:
+			self._last[name] = payload
+			self.stats['writes'] += 1
+		return True
+
+	def read(self,name):
+		''' read the snapshot for name, None if there is none '''
+		try:
+			with open(self.path(name),'rb') as f:
+				return decode(f.read(),self.fmt)
+		except FileNotFoundError:
+			return None
+
+def read_file(path):
+	''' decode a snapshot file, the format is taken from its extension '''
+	fmt = 'pickle' if path.endswith(formats['pickle']) else 'json'
+	with open(path,'rb') as f:
+		return decode(f.read(),fmt)
+
+if __name__ == "__main__":
+	import sys
+	if len(sys.argv) < 2:
+		print(f'usage: {sys.argv[0]} snapshot...',file=sys.stderr)
+		sys.exit(1)
+	for path in sys.argv[1:]:
+		print(json.dumps({'path': path, 'data': read_file(path)},default=str))
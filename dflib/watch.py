@@ -0,0 +1,260 @@
+'''
+File change notification.
+A Watcher runs one background thread that tells subscribers when a file they
+subscribed to has been written. On Linux the directories holding the files
+are watched with inotify, so nothing is done until a file actually changes.
+Elsewhere, for directories inotify cannot watch and for directories on
+network or FUSE filesystems, where inotify accepts the watch but never hears
+of changes made on the other side, the files are polled by stat every
+interval seconds.
+
+Callbacks are called with the path that changed. They are called on the
+watcher thread through dispatch, which by default calls them directly; a
+Gtk program will want to hand them to the main loop instead.
+'''
+import os
+import sys
+import select
+import struct
+import threading
+import ctypes
+import ctypes.util
+from dflib.debug import debug
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+_mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+_event = struct.Struct('iIII')
+
+def _inotify():
+	''' return libc if it has inotify, otherwise None '''
+	if not sys.platform.startswith('linux'):
+		return None
+	try:
+		libc = ctypes.CDLL(ctypes.util.find_library('c'),use_errno=True)
+		libc.inotify_init1
+		libc.inotify_add_watch
+		libc.inotify_rm_watch
+	except (OSError,AttributeError):
+		return None
+	return libc
+
+# filesystems whose changes can come from elsewhere, inotify misses those
+remote_fs = ('nfs','nfs4','cifs','smb3','smbfs','ncpfs','afs','9p','ceph',
+	'glusterfs','lustre','davfs','sshfs','afpfs','webdav')
+
+def _unescape(field):
+	''' undo the octal escapes /proc/mounts uses for spaces and the like '''
+	return field.replace('\\040',' ').replace('\\011','\t').replace('\\012','\n').replace('\\134','\\')
+
+def fs_type(path):
+	''' the type of the filesystem path is on, from /proc/mounts, None if unknown '''
+	path = os.path.realpath(path)
+	best = None
+	try:
+		with open('/proc/mounts') as f:
+			for line in f:
+				fields = line.split()
+				if len(fields) < 3:
+					continue
+				mount = _unescape(fields[1])
+				inside = path == mount or path.startswith(mount.rstrip('/') + '/')
+				if inside and (not best or len(mount) > len(best[0])):
+					best = (mount,fields[2])
+	except OSError:
+		return None
+	return best[1] if best else None
+
+def is_local(path):
+	''' whether inotify can be trusted to see every change under path '''
+	fstype = fs_type(path)
+	if fstype is None:
+		return False
+	return not (fstype in remote_fs or fstype.startswith('fuse'))
+
+def direct_dispatch(callback,path):
+	callback(path)
+
+class Watcher:
+	'''
+	Watch files for changes and call subscribers when they change.
+	Keyword arguments:
+		interval - seconds between polls of files inotify is not watching
+		dispatch - called as dispatch(callback,path) to deliver a change
+		use_inotify - set False to always poll
+	'''
+	def __init__(self,**kwargs):
+		self.interval = 0.5
+		self.dispatch = direct_dispatch
+		self.use_inotify = True
+		for k,v in kwargs.items():
+			if k in ['interval','dispatch','use_inotify']:
+				setattr(self,k,v)
+			else:
+				raise ValueError(f'Invalid keyword argument {k}')
+		self._lock = threading.Lock()
+		self._subscribers = {}
+		self._next_token = 1
+		self._polled = {}
+		self._dirs = {}
+		self._wds = {}
+		self._thread = None
+		self._running = False
+		self._fd = None
+		self._libc = _inotify() if self.use_inotify else None
+		if self._libc:
+			fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+			if fd >= 0:
+				self._fd = fd
+			else:
+				debug('inotify_init1 failed, polling instead')
+
+	def _stat(self,path):
+		try:
+			st = os.stat(path)
+			return (st.st_ino,st.st_mtime_ns,st.st_size)
+		except OSError:
+			return None
+
+	def _watch_dir(self,dirname):
+		''' add an inotify watch for dirname, return False if we cannot '''
+		if self._fd is None:
+			return False
+		if dirname in self._dirs:
+			return True
+		if not is_local(dirname):
+			debug(f'{dirname} is not on a local filesystem, polling it')
+			return False
+		wd = self._libc.inotify_add_watch(self._fd,os.fsencode(dirname),_mask)
+		if wd < 0:
+			debug(f'cannot watch {dirname}, polling it')
+			return False
+		self._dirs[dirname] = wd
+		self._wds[wd] = dirname
+		return True
+
+	def _unwatch_dir(self,dirname):
+		''' drop the inotify watch for dirname once nothing subscribed is in it '''
+		wd = self._dirs.get(dirname)
+		if wd is None:
+			return
+		if any(os.path.dirname(path) == dirname for path in self._subscribers):
+			return
+		self._libc.inotify_rm_watch(self._fd,wd)
+		del self._dirs[dirname]
+		del self._wds[wd]
+
+	def subscribe(self,path,callback):
+		''' call callback(path) whenever path changes, returns a token for unsubscribe '''
+		path = os.path.abspath(path)
+		with self._lock:
+			token = self._next_token
+			self._next_token += 1
+			if not path in self._subscribers:
+				self._subscribers[path] = {}
+				if not self._watch_dir(os.path.dirname(path)):
+					self._polled[path] = self._stat(path)
+			self._subscribers[path][token] = callback
+		self.start()
+		return token
+
+	def unsubscribe(self,token):
+		''' stop the callback subscribed with token '''
+		with self._lock:
+			for path, callbacks in list(self._subscribers.items()):
+				if token in callbacks:
+					del callbacks[token]
+					if not callbacks:
+						del self._subscribers[path]
+						self._polled.pop(path,None)
+						self._unwatch_dir(os.path.dirname(path))
+					return
+
+	def _notify(self,paths):
+		with self._lock:
+			calls = []
+			for path in paths:
+				for callback in self._subscribers.get(path,{}).values():
+					calls.append((callback,path))
+		for callback, path in calls:
+			try:
+				self.dispatch(callback,path)
+			except Exception as e:
+				debug(f'watch callback for {path} failed: {e}')
+
+	def _read_events(self):
+		''' read pending inotify events, return the set of subscribed paths they name '''
+		changed = set()
+		try:
+			buf = os.read(self._fd,65536)
+		except BlockingIOError:
+			return changed
+		offset = 0
+		with self._lock:
+			while offset + _event.size <= len(buf):
+				wd, mask, cookie, length = _event.unpack_from(buf,offset)
+				offset += _event.size
+				name = buf[offset:offset+length].rstrip(b'\0')
+				offset += length
+				dirname = self._wds.get(wd)
+				if dirname and name:
+					path = os.path.join(dirname,os.fsdecode(name))
+					if path in self._subscribers:
+						changed.add(path)
+		return changed
+
+	def _poll(self):
+		''' stat polled files, return the set of those that changed '''
+		changed = set()
+		with self._lock:
+			paths = list(self._polled.items())
+		for path, old in paths:
+			new = self._stat(path)
+			if new != old:
+				with self._lock:
+					if path in self._polled:
+						self._polled[path] = new
+				if new:
+					changed.add(path)
+		return changed
+
+	def _run(self):
+		while self._running:
+			changed = set()
+			if self._fd is not None:
+				ready, _, _ = select.select([self._fd],[],[],self.interval)
+				if ready:
+					changed |= self._read_events()
+			else:
+				self._stop_event.wait(self.interval)
+			if self._polled:
+				changed |= self._poll()
+			if changed:
+				self._notify(changed)
+
+	def start(self):
+		''' start the watcher thread if it is not running '''
+		if self._running:
+			return
+		self._running = True
+		self._stop_event = threading.Event()
+		self._thread = threading.Thread(target=self._run,name='watcher',daemon=True)
+		self._thread.start()
+
+	def stop(self):
+		''' stop the watcher thread '''
+		self._running = False
+		if self._thread:
+			self._stop_event.set()
+			self._thread.join()
+			self._thread = None
+
+_watcher = None
+
+def get_watcher(**kwargs):
+	''' the process wide Watcher, created with kwargs on first use '''
+	global _watcher
+	if not _watcher:
+		_watcher = Watcher(**kwargs)
+	return _watcher
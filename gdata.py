@@ -4,7 +4,9 @@ import os
 import json
 import time
 import argparse
+import threading
 import psutil
+from concurrent.futures import ThreadPoolExecutor, wait
 
 def is_running(pid_file):
 	'''
@@ -57,55 +59,248 @@ def log(*args):
 		print(f'{tstr}:',*args,file=f)
 		debug(*args)
 
-def get_config():
+class ConfigSource:
 	'''
-	read common config file 
+	The config file, read again only when it changes. get() costs a stat
+	of the file while its inode, modification time and size stay the
+	same. A file that will not parse leaves the last good config in use
+	and is reported once, not on every get().
 	'''
-	try:
-		with open('sensors.json') as f:
-			return  json.load(f)
-	except:
-		return None
-def main(base_dir,pid_file):
+	def __init__(self,path='sensors.json'):
+		self.path = path
+		self.config = None
+		self.changed = False
+		self._stat = None
+		self._bad = None
+
+	def get(self):
+		''' the config, reloaded if the file has changed. Sets changed. '''
+		self.changed = False
+		try:
+			st = os.stat(self.path)
+		except OSError:
+			return self.config
+		stat = (st.st_ino,st.st_mtime_ns,st.st_size)
+		if stat == self._stat or stat == self._bad:
+			return self.config
+		try:
+			with open(self.path) as f:
+				config = json.load(f)
+		except (OSError,ValueError) as e:
+			log(f'Cannot load {self.path}: {e}')
+			self._bad = stat
+			return self.config
+		self._stat = stat
+		self.changed = config != self.config
+		self.config = config
+		return self.config
+
+class PollScheduler:
+	'''
+	Read all defined sensors concurrently on a bounded thread pool.
+	Sensors are read with one batch request per server. When a server 
+	cannot do batch reads each sensor is read on its own and each host 
+	gets a semaphore so a slow or dead host can only tie up 
+	max_per_host workers, and each read has a deadline after which the 
+	cycle moves on without it. A read that blows its deadline is left to 
+	finish in the background and that sensor is skipped until it does, so 
+	a dead host never piles up work.
+	'''
+	def __init__(self,base_dir,max_workers=8,max_per_host=2,deadline=10.0,fmt='json',store=None,history=None):
+		self.base_dir = base_dir
+		self.writer = snapshot.SnapshotWriter(base_dir,fmt)
+		self.store = store
+		self.history = history
+		self.unstored = set()
+		''' sensors the snapshot store could not take, logged once '''
+		self.appended = {}
+		''' (host, sensor) -> time of the last reading added to the history '''
+		self.max_per_host = max_per_host
+		self.deadline = deadline
+		self.executor = ThreadPoolExecutor(max_workers=max_workers,thread_name_prefix='poll')
+		self.host_limits = {}
+		self.pending = {}
+		self.clients = {}
+		self.server = None
+		self.pairs = []
+		self._jobs_for = None
+		self._job_table = {}
+
+	def _host_limit(self,host):
+		''' get (or create) the concurrency limit for host '''
+		if not host in self.host_limits:
+			self.host_limits[host] = threading.BoundedSemaphore(self.max_per_host)
+		return self.host_limits[host]
+
+	def _client(self,server,host,sen):
+		''' get the RestClient for a sensor, they are kept between cycles '''
+		key = (server,host,sen)
+		if not key in self.clients:
+			self.clients[key] = rest.RestClient(
+				server=server,
+				host=host,
+				sensor=sen,
+				timeout=self.deadline)
+		return self.clients[key]
+
+	def _write(self,host,sen,sensor_data):
+		''' 
+		write sensor data to {base_dir}/{host}-{sen}.json, and the snapshot 
+		store if there is one, unless it is an error. Every reading is
+		appended to the history, even one that repeats the last value, but
+		a reading carrying the same time as the last one is only added once.
+		'''
+		if not 'error' in sensor_data:
+			if self.writer.write(f'{host}-{sen}',sensor_data):
+				debug("Wrote",self.writer.path(f'{host}-{sen}'))
+			if self.history:
+				stamp = sensor_data.get('time')
+				if stamp is None or self.appended.get((host,sen)) != stamp:
+					self.appended[(host,sen)] = stamp
+					self.history.append(host,sen,sensor_data)
+			if self.store:
+				try:
+					self.store.put(host,sen,sensor_data)
+				except (ValueError,MemoryError) as e:
+					# too big for a slot or no slot free, the file still has it
+					if not (host,sen) in self.unstored:
+						self.unstored.add((host,sen))
+						log(f'Not keeping {host}/{sen} in the snapshot store: {e}')
+
+	def _poll_sensor(self,server,host,sen):
+		'''
+		read one sensor and write its data. this runs on a worker thread.
+		'''
+		with self._host_limit(host):
+			debug(server,host,sen)
+			sensor_data = self._client(server,host,sen).read()
+		self._write(host,sen,sensor_data)
+
+	def _poll_server(self,server,pairs):
+		'''
+		read every (host, sensor) in pairs from server in one request and
+		write their data. this runs on a worker thread.
+		'''
+		debug(server,pairs)
+		results = self._client(server,'none','none').read_many(pairs)
+		for (host,sen),sensor_data in results.items():
+			self._write(host,sen,sensor_data)
+
+	def configure(self,config):
+		'''
+		take the sensors to read from config. Only a change to the server or
+		the set of sensors changes the jobs, sensors that have gone are
+		forgotten and new ones picked up. Returns True if anything changed.
+		'''
+		server = config['server']
+		pairs = []
+		for name,sensor in config['sensors'].items():
+			# old style files also hold the window positions
+			if not 'host' in sensor or not 'sensor' in sensor:
+				continue
+			pair = (sensor['host'],sensor['sensor'])
+			if not pair in pairs:
+				pairs.append(pair)
+		if server == self.server and pairs == self.pairs:
+			return False
+		old = set(self.pairs) if server == self.server else set()
+		removed = set(self.pairs) - set(pairs) if server == self.server else set(self.pairs)
+		added = set(pairs) - old
+		for host, sen in removed:
+			self.clients.pop((self.server,host,sen),None)
+			self.pending.pop((self.server,host,sen),None)
+			self.appended.pop((host,sen),None)
+		if server != self.server:
+			self.pending.pop((self.server,),None)
+		self.server = server
+		self.pairs = pairs
+		self._jobs_for = None
+		log(f'Sensors: {len(added)} added, {len(removed)} removed, {len(pairs)} to read')
+		return True
+
+	def _jobs(self):
+		'''
+		the jobs for a cycle as a dict of key -> (function, args). Normally
+		there is one job per server reading all of its sensors at once.
+		Servers known not to support batch reads get a job per sensor. The
+		table is only rebuilt when the sensors or batch support change.
+		'''
+		if not self.pairs:
+			return {}
+		batch = rest.batch_supported(self.server) != False
+		if self._jobs_for == batch:
+			return self._job_table
+		server = self.server
+		jobs = {}
+		if not batch:
+			for host, sen in self.pairs:
+				jobs[(server,host,sen)] = (self._poll_sensor,(server,host,sen))
+		else:
+			jobs[(server,)] = (self._poll_server,(server,list(self.pairs)))
+		self._job_table = jobs
+		self._jobs_for = batch
+		return jobs
+
+	def poll(self,config=None):
+		'''
+		start the reads for every sensor and wait for them, up to the
+		deadline. If config is given configure from it first.
+		'''
+		if config:
+			self.configure(config)
+		futures = {}
+		for key,(func,args) in self._jobs().items():
+			if key in self.pending:
+				if not self.pending[key].done():
+					debug(f'{"-".join(key)} still busy from a previous cycle')
+					continue
+				del self.pending[key]
+			futures[key] = self.executor.submit(func,*args)
+		if not futures:
+			return
+		done, not_done = wait(futures.values(),timeout=self.deadline)
+		for key,future in futures.items():
+			what = '-'.join(key)
+			if future in not_done:
+				log(f'Deadline exceeded getting data for {what}')
+				self.pending[key] = future
+			elif future.exception():
+				log(f'Exception getting data for {what}: {future.exception()}')
+
+	def shutdown(self):
+		''' stop the worker pool without waiting on stuck reads '''
+		self.executor.shutdown(wait=False,cancel_futures=True)
+
+def main(base_dir,pid_file,scheduler=None):
 	'''
-	loop through defined sensors and write data to {base_dir}/{host}-{sensor}.json
-	sleep for poll interval miliseconds
+	poll defined sensors and write data to {base_dir}/{host}-{sensor}.json
+	once every poll interval miliseconds. The period is fixed: time spent 
+	polling comes out of the sleep rather than being added to it.
 	'''
+	if not scheduler:
+		scheduler = PollScheduler(base_dir)
+	source = ConfigSource('sensors.json')
 	config = None
 	while not config:
-		config = get_config()
+		config = source.get()
 		if not config:
 			time.sleep(1)
+	scheduler.configure(config)
 	poll_interval = config['poll_interval']/1000
+	next_cycle = time.monotonic()
 	while True:
-		time.sleep(poll_interval)
-		config = get_config()
-		if not config:
-			continue
-		poll_interval = config['poll_interval']/1000
-		for name,sensor in config['sensors'].items():
-			if '::' in name:
-				continue
-			#if not sensor['active']:
-			#	continue
-			host = sensor['host']
-			sen = sensor['sensor']
-			server = config['server']
-			debug(server,host,sensor)
-			data_file = f'{base_dir}/{host}-{sen}.json'
-			client = rest.RestClient(
-				server=server,
-				host=host,
-				sensor=sen)
-			try:
-				sensor_data = client.read()
-				if not 'error' in sensor_data:
-					with open(data_file,'w') as f:
-						debug("Writing",data_file)
-						json.dump(sensor_data,f,indent=2)
-			except Exception as e:
-				with open('/tmp/get-data.log','a') as f:
-					log(f'Exception getting data for {host}-{sen}: {e}')
+		next_cycle += poll_interval
+		delay = next_cycle - time.monotonic()
+		if delay > 0:
+			time.sleep(delay)
+		else:
+			# we overran the period, start again from now instead of bursting
+			next_cycle = time.monotonic()
+		config = source.get()
+		if source.changed:
+			scheduler.configure(config)
+			poll_interval = config['poll_interval']/1000
+		scheduler.poll()
 
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser(
@@ -115,6 +310,12 @@ if __name__ == "__main__":
 		)
 	parser.add_argument('-d','--debug',action='store_true',default=False,help='turn on copious debugging messages')
 	parser.add_argument('-rp','--run-path',type=str,default=None,help='run program in path',metavar="path")
+	parser.add_argument('-w','--workers',type=int,default=8,help='number of concurrent sensor reads',metavar="n")
+	parser.add_argument('-ph','--per-host',type=int,default=2,help='concurrent reads allowed per sensor host',metavar="n")
+	parser.add_argument('-dl','--deadline',type=float,default=10.0,help='seconds to wait for a sensor read',metavar="secs")
+	parser.add_argument('-s','--shm',type=str,default=None,help='also keep readings in a memory mapped snapshot store',metavar="file")
+	parser.add_argument('-hs','--history',type=str,default=None,help='history database, empty for none, default history_db from sensors.json',metavar="file")
+	parser.add_argument('-f','--format',type=str,default='json',choices=['json','pickle'],help='format of sensor data files')
 	args = parser.parse_args()
 	prog_dir = os.path.dirname(os.path.realpath(sys.argv[0]))
 	if args.run_path:
@@ -123,17 +324,33 @@ if __name__ == "__main__":
 	sys.path.append(os.path.expanduser('~/lib'))
 	sys.path.append(prog_dir)
 
-	from dflib import rest
+	from dflib import rest, snapshot, shmstore
+	import history
 	from dflib.debug import *
 	
 	pid_file = '/tmp/get-data.pid'
 	data_path = '/Volumes/RamDisk/sensordata'
 
 	set_debug(args.debug)
+	if args.history is None:
+		args.history = (ConfigSource('sensors.json').get() or {}).get('history_db','history.db')
+	scheduler = None
 	try:
 		startup(pid_file)
-		main(data_path,pid_file)
+		rest.configure_sessions(pool_size=args.workers)
+		scheduler = PollScheduler(
+			data_path,
+			max_workers=args.workers,
+			max_per_host=args.per_host,
+			deadline=args.deadline,
+			fmt=args.format,
+			store=shmstore.ShmStore(args.shm,create=True) if args.shm else None,
+			history=history.open_history(args.history,writable=True) if args.history else None)
+		main(data_path,pid_file,scheduler)
 	except KeyboardInterrupt:
 		pass
 	except Exception as e:
 		log(f'Exception: {e}')
+	finally:
+		if scheduler:
+			scheduler.shutdown()
@@ -0,0 +1,302 @@
+'''
+Time series history of sensor readings.
+The collector appends every new reading to a sqlite database. Each numeric
+key of a reading is a series, stored in three tiers:
+	raw			every sample, kept for two days
+	rollup_60	one row per minute with min, max, sum and count, kept 30 days
+	rollup_3600	one row per hour, kept two years
+The rollups are maintained as samples arrive so they never need rebuilding.
+Charts backfill from the raw tier and long range views query the finest
+tier that fits in the points they can show. Browsing reads the tiers in
+fixed size tiles and keeps the recently used ones in memory.
+'''
+import os
+import time
+import bisect
+import sqlite3
+import threading
+from collections import OrderedDict
+from dflib.debug import debug
+
+# tile is the span in seconds of the blocks browse() reads and caches
+tiers = [
+	{'table': 'raw',			'resolution': 0,	'retention': 2*86400,	'tile': 900},
+	{'table': 'rollup_60',		'resolution': 60,	'retention': 30*86400,	'tile': 500*60},
+	{'table': 'rollup_3600',	'resolution': 3600,	'retention': 730*86400,	'tile': 500*3600},
+]
+
+_schema = [
+	'''create table if not exists series (
+		id integer primary key,
+		host text not null,
+		sensor text not null,
+		key text not null,
+		unique (host,sensor,key))''',
+	'''create table if not exists raw (
+		series integer not null,
+		time real not null,
+		value real not null)''',
+	'create index if not exists raw_series_time on raw (series,time)',
+	'''create table if not exists rollup_60 (
+		series integer not null,
+		bucket integer not null,
+		min real, max real, sum real, count integer,
+		primary key (series,bucket)) without rowid''',
+	'''create table if not exists rollup_3600 (
+		series integer not null,
+		bucket integer not null,
+		min real, max real, sum real, count integer,
+		primary key (series,bucket)) without rowid''',
+]
+
+def _select(tier,condition):
+	'''
+	sql selecting (time, avg, min, max) of a series from tier where the
+	time is condition. {column} in condition is the time column.
+	'''
+	if tier['table'] == 'raw':
+		column = 'time'
+		fields = 'time, value, value, value'
+	else:
+		column = 'bucket'
+		fields = f"bucket + {tier['resolution']/2}, sum/count, min, max"
+	condition = condition.format(column=column)
+	return f"select {fields} from {tier['table']} where series=? and {column} {condition} order by {column}"
+
+def _rebucket(rows,max_points):
+	'''
+	rows of (time, avg, min, max) merged into at most max_points evenly
+	spaced buckets, keeping the lowest min and highest max of each
+	'''
+	if not max_points or len(rows) <= max_points:
+		return rows
+	first = rows[0][0]
+	width = (rows[-1][0] - first) / max_points or 1
+	buckets = []
+	last = None
+	for t, avg, low, high in rows:
+		index = min(int((t - first) / width),max_points - 1)
+		if index != last:
+			buckets.append([0.0,0.0,0,low,high])
+			last = index
+		bucket = buckets[-1]
+		bucket[0] += t
+		bucket[1] += avg
+		bucket[2] += 1
+		bucket[3] = min(bucket[3],low)
+		bucket[4] = max(bucket[4],high)
+	return [(t/n, total/n, low, high) for t, total, n, low, high in buckets]
+
+def _numeric(value):
+	return type(value) in (int,float)
+
+class HistoryStore:
+	'''
+	History database in path. The collector opens it writable, everything
+	else read only. Each thread gets its own connection.
+	'''
+	def __init__(self,path,writable=False,prune_interval=600,max_tiles=64):
+		self.path = path
+		self.writable = writable
+		self.prune_interval = prune_interval
+		self.max_tiles = max_tiles
+		self._local = threading.local()
+		self._lock = threading.Lock()
+		self._tiles = OrderedDict()
+		self._tiles_lock = threading.Lock()
+		self._series = {}
+		self._last_prune = 0
+		if writable:
+			con = self._conn()
+			con.execute('pragma journal_mode=wal')
+			for sql in _schema:
+				con.execute(sql)
+			con.commit()
+
+	def _conn(self):
+		con = getattr(self._local,'con',None)
+		if not con:
+			if self.writable:
+				con = sqlite3.connect(self.path,timeout=5)
+				con.execute('pragma synchronous=normal')
+			else:
+				con = sqlite3.connect(f'file:{self.path}?mode=ro',uri=True,timeout=5)
+			self._local.con = con
+		return con
+
+	def _series_id(self,con,host,sensor,key,create=False):
+		k = (host,sensor,key)
+		if k in self._series:
+			return self._series[k]
+		row = con.execute('select id from series where host=? and sensor=? and key=?',k).fetchone()
+		if not row:
+			if not create:
+				return None
+			cur = con.execute('insert into series (host,sensor,key) values (?,?,?)',k)
+			sid = cur.lastrowid
+		else:
+			sid = row[0]
+		self._series[k] = sid
+		return sid
+
+	def append(self,host,sensor,reading,timestamp=None):
+		'''
+		append every numeric key of reading. The reading's own time is used
+		if it has one, otherwise timestamp or now.
+		'''
+		if 'time' in reading and _numeric(reading['time']):
+			t = float(reading['time'])
+		else:
+			t = timestamp or time.time()
+		values = [(k,float(v)) for k,v in reading.items() if k != 'time' and _numeric(v) and not type(v) is bool]
+		if not values:
+			return
+		with self._lock:
+			con = self._conn()
+			with con:
+				for key, value in values:
+					sid = self._series_id(con,host,sensor,key,True)
+					con.execute('insert into raw (series,time,value) values (?,?,?)',(sid,t,value))
+					for tier in tiers[1:]:
+						bucket = int(t // tier['resolution']) * tier['resolution']
+						con.execute(f'''insert into {tier['table']} (series,bucket,min,max,sum,count)
+							values (?,?,?,?,?,1)
+							on conflict (series,bucket) do update set
+								min = min(min,excluded.min),
+								max = max(max,excluded.max),
+								sum = sum + excluded.sum,
+								count = count + 1''',(sid,bucket,value,value,value))
+			due = time.time() - self._last_prune > self.prune_interval
+			if due:
+				self._last_prune = time.time()
+		# outside the lock so other sensors' appends are not held up
+		if due:
+			self.prune()
+
+	def prune(self):
+		'''
+		drop rows older than each tier's retention. Each series is pruned
+		in its own short transaction, through the (series, time) indexes,
+		so appends can go on in between.
+		'''
+		now = time.time()
+		self._last_prune = now
+		con = self._conn()
+		sids = [row[0] for row in con.execute('select id from series').fetchall()]
+		for tier in tiers:
+			column = 'time' if tier['table'] == 'raw' else 'bucket'
+			pruned = 0
+			for sid in sids:
+				with con:
+					cur = con.execute(f"delete from {tier['table']} where series=? and {column} < ?",(sid,now - tier['retention']))
+					pruned += max(cur.rowcount,0)
+			if pruned:
+				debug(f"pruned {pruned} rows from {tier['table']}")
+
+	def recent(self,host,sensor,key,count):
+		''' the last count raw samples as a list of (time, value), oldest first '''
+		con = self._conn()
+		sid = self._series_id(con,host,sensor,key)
+		if sid is None:
+			return []
+		rows = con.execute('select time, value from raw where series=? order by time desc limit ?',(sid,count)).fetchall()
+		rows.reverse()
+		return rows
+
+	def choose_tier(self,start,end,max_points=None,raw_count=None):
+		'''
+		the finest tier whose retention covers start and that gives at most
+		max_points points between start and end. raw_count is the number of
+		raw samples in the range, without it raw is only chosen when there
+		is no max_points.
+		'''
+		now = time.time()
+		for tier in tiers:
+			if start < now - tier['retention']:
+				continue
+			if not max_points:
+				return tier
+			if tier['resolution']:
+				points = (end - start)/tier['resolution']
+			elif raw_count is not None:
+				points = raw_count
+			else:
+				continue
+			if points <= max_points:
+				return tier
+		return tiers[-1]
+
+	def query(self,host,sensor,key,start,end,max_points=None):
+		'''
+		samples of host/sensor/key between start and end as a list of
+		(time, avg, min, max), oldest first, from the tier chosen by
+		choose_tier. For raw samples avg, min and max are the same value.
+		If even the coarsest tier has more than max_points rows in the range
+		they are merged down to max_points.
+		'''
+		con = self._conn()
+		sid = self._series_id(con,host,sensor,key)
+		if sid is None:
+			return []
+		tier = self._tier_for(con,sid,start,end,max_points)
+		if tier['resolution']:
+			start = int(start // tier['resolution']) * tier['resolution']
+		rows = con.execute(_select(tier,'between ? and ?'),(sid,start,end)).fetchall()
+		return _rebucket(rows,max_points)
+
+	def _tier_for(self,con,sid,start,end,max_points):
+		raw_count = None
+		if max_points and start >= time.time() - tiers[0]['retention']:
+			raw_count = con.execute('select count(*) from raw where series=? and time between ? and ?',(sid,start,end)).fetchone()[0]
+		return self.choose_tier(start,end,max_points,raw_count)
+
+	def browse(self,host,sensor,key,start,end,max_points):
+		'''
+		samples for a chart showing start to end in max_points pixels, as
+		(tier, rows) with rows as for query plus the row either side of
+		the range. The tier is read in whole tiles and the most recently
+		used max_tiles are kept, so panning and zooming back over the same
+		ground does not go back to the database. Rows are merged down to
+		max_points when even the coarsest tier has more.
+		'''
+		con = self._conn()
+		sid = self._series_id(con,host,sensor,key)
+		if sid is None:
+			return None, []
+		tier = self._tier_for(con,sid,start,end,max_points)
+		span = tier['tile']
+		rows = []
+		for index in range(int(start // span) - 1,int(end // span) + 2):
+			rows.extend(self._tile(con,sid,tier,index))
+		times = [row[0] for row in rows]
+		first = max(bisect.bisect_left(times,start) - 1,0)
+		last = bisect.bisect_right(times,end) + 1
+		return tier, _rebucket(rows[first:last],max_points)
+
+	def _tile(self,con,sid,tier,index):
+		''' the rows of tile index of tier, from the cache if we have it '''
+		key = (sid,tier['table'],index)
+		with self._tiles_lock:
+			rows = self._tiles.get(key)
+			if rows is not None:
+				self._tiles.move_to_end(key)
+				return rows
+		start = index * tier['tile']
+		end = start + tier['tile']
+		rows = con.execute(_select(tier,'>= ? and {column} < ?'),(sid,start,end)).fetchall()
+		# the newest tile is still filling up, keep reading it
+		if end + tier['resolution'] < time.time():
+			with self._tiles_lock:
+				self._tiles[key] = rows
+				while len(self._tiles) > self.max_tiles:
+					self._tiles.popitem(last=False)
+		return rows
+
+_stores = {}
+
+def open_history(path,writable=False):
+	''' the process wide HistoryStore for path '''
+	key = (os.path.abspath(path),writable)
+	if not key in _stores:
+		_stores[key] = HistoryStore(path,writable)
+	return _stores[key]
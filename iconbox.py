@@ -1,4 +1,3 @@
-import os
 import gi
 from enum import Enum
 gi.require_version('Gtk', '3.0')
@@ -30,6 +29,10 @@ class IconWindow(Gtk.ScrolledWindow):
 		''' callback for add item '''
 		self.pixmap = {}
 		''' images to use for icons '''
+		self.rows = {}
+		''' Gtk.TreeRowReference of each icon's row by name '''
+		self.menu_item = None
+		''' the icon the icon context menu was opened on '''
 		self.sort_dir = Gtk.SortType.ASCENDING
 		''' sorting direction '''
 		self.sort_column = 1
@@ -78,6 +81,8 @@ class IconWindow(Gtk.ScrolledWindow):
 		self.add(self.icon_view)
 		self.create_icons()
 		self.context_menu = self.create_scrolled_window_context_menu()
+		if self.icon_menu:
+			self.icon_context_menu = self.create_icon_context_menu()
 		first_path = Gtk.TreePath.new_first() # These two lines select the first 
 		self.icon_view.select_path(first_path) # icon in the iconview
 		self.show_all()
@@ -94,96 +99,98 @@ class IconWindow(Gtk.ScrolledWindow):
 	def rename_icon(self,old,new):
 		''' rename an icon '''
 		if old in self.icon_dict:
-			tmp = self.icon_dict[old]
-			self.icon_dict[old] = None
-			del self.icon_dict[old]
-			self.icon_dict[new] = tmp
-
-	def _get_icon_store_by_name(self,name):
-		index = 0
-		for row in self.icon_store:
-			if row[1] == name:
-				return index
-			index += 1
-		return False
-
-	def _signal_row_change(self, index):
-		tree_path = Gtk.TreePath.new_from_indices([index])
-		iter = self.icon_store.get_iter(tree_path)
-		self.icon_store.emit('row-changed',tree_path, iter)
+			self.icon_dict[new] = self.icon_dict.pop(old)
+			self.icon_dict[new]['name'] = new
+			if old in self.pixmap:
+				self.pixmap[new] = self.pixmap.pop(old)
+			if old in self.rows:
+				self.rows[new] = self.rows.pop(old)
+				self.icon_store.set_value(self._row_iter(new),1,new)
+
+	def _row_iter(self,name):
+		''' the icon_store iter of name's row, None if it has none '''
+		ref = self.rows.get(name)
+		if not ref or not ref.valid():
+			return None
+		return self.icon_store.get_iter(ref.get_path())
+
+	def _state(self,name):
+		''' which image of name to show, from its open windows '''
+		state = 0
+		if self.active_windows and name in self.active_windows:
+			state |= 1
+		if self.active_charts and name in self.active_charts:
+			state |= 2
+		return state
 
 	def activate_icon(self,name,active):
 		''' activate icon by using an overlaid image to show activity '''
-		index = self._get_icon_store_by_name(name)
-		if type(index) is int:
-			row = self.icon_store[index]
-			active_icon = self.pixmap[name]['images'][active]
-			icon_name = self.pixmap[name]['icon_name']
-			row[0] = active_icon
-			self._signal_row_change(index)
+		iter = self._row_iter(name)
+		if iter is not None:
+			self.icon_store.set_value(iter,0,self.pixmap[name]['images'][active])
 		else:
-			debug('bad index',type(index),index)
+			debug('no row for',name)
 	
 	def deactivate_icon(self,name,active):
 		''' remove overlaid image to indicate activity done '''
 		self.activate_icon(name,active)
-		index = self._get_icon_store_by_name(name)
-		if type(index) is int:
-			row = self.icon_store[index]
-			inactive_icon = self.pixmap[name]['inactive']
-			debug(name,row[1],row[0],inactive_icon)
-			row[0] = inactive_icon
-			self._signal_row_change(index)
 
 	def update_icon(self,old_name, new_name, icon_name):
-		''' change icon's image '''
-		if old_name in self.icon_dict:
-			del self.icon_dict[old_name]
-		self.icon_dict[new_name] = {'name': new_name, 'icon': icon_name}
-		self.create_icons()
+		''' change icon's name and image '''
+		if not old_name in self.rows and new_name in self.rows:
+			# renamed already
+			old_name = new_name
+		if not old_name in self.rows:
+			self.add_icon(icon_name,new_name)
+			return
+		self.rename_icon(old_name,new_name)
+		self.icon_dict[new_name]['icon'] = icon_name
+		self._set_images(new_name,icon_name)
+		self.icon_store.set_value(self._row_iter(new_name),0,
+			self.pixmap[new_name]['images'][self._state(new_name)])
 	
 	def delete_icon(self,item):
 		''' delete icon - this is used when the maain code deletes a sensor '''
 		if item in self.icon_dict:
 			del self.icon_dict[item]
-			self.icon_store.clear()
-			self.create_icons()
-			debug("icon removed and list regenderated")
+			self.pixmap.pop(item,None)
+			iter = self._row_iter(item)
+			if iter is not None:
+				self.icon_store.remove(iter)
+			self.rows.pop(item,None)
+			debug("icon removed")
 		else:
 			debug(f"no {item} in {self.icon_dict}")
 
 	def add_icon(self,icon,item):
 		''' add icon - this is used when the main code adds a sensor '''
 		self.icon_dict[item] = {'name': item, 'icon': icon}
-		self.create_icons()
+		self._add_row(self.icon_dict[item])
+
+	def _set_images(self,name,icon):
+		self.pixmap[name] = {
+			"icon_name": icon,
+			'images': iconimages.get_icon_images(icon)}
+
+	def _add_row(self,value):
+		''' append the row for value and index it by name '''
+		name = value['name']
+		self._set_images(name,value['icon'])
+		pimage = self.pixmap[name]['images'][self._state(name)]
+		iter = self.icon_store.append([pimage, name, value.get('type','icon')])
+		self.rows[name] = Gtk.TreeRowReference.new(self.icon_store,self.icon_store.get_path(iter))
 
 	def create_icons(self):
 		''' Create the icons from the icon_dict '''
+		# fill the store unsorted and detached from the view, then sort once
+		self.icon_view.set_model(None)
+		self.icon_store.set_sort_column_id(Gtk.TREE_SORTABLE_UNSORTED_SORT_COLUMN_ID,self.sort_dir)
 		self.icon_store.clear()
-		for key, value in self.icon_dict.items():
-			iaipath = value['icon']
-			aipath,ext = os.path.splitext(iaipath)
-			aipath = f'{aipath}-active{ext}'
-
-			icon_images = 	iconimages.get_icon_images(value['icon'])
-			self.pixmap[value['name']] = {
-				"icon_name": value['icon'],
-				'images': icon_images}
-
-			itype = 0
-			if self.active_windows and value['name'] in self.active_windows:
-				itype |= 1
-			if self.active_charts and value['name'] in self.active_charts:
-				itype |= 2
-
-			pimage = icon_images[itype]
-			if 'type' in value:
-				self.icon_store.append([pimage, value["name"], value['type']])
-			else:
-				self.icon_store.append([pimage, value["name"], "icon"])
-			self.sort_by_name()
-			if self.icon_menu:
-				self.icon_dict[key]['menu'] = self.create_icon_context_menu(key)
+		self.rows = {}
+		for value in self.icon_dict.values():
+			self._add_row(value)
+		self.icon_store.set_sort_column_id(self.sort_column,self.sort_dir)
+		self.icon_view.set_model(self.icon_store)
 
 	def on_icon_button_press(self, widget, event):
 		''' when icon is clicked  call back to main code '''
@@ -193,11 +200,10 @@ class IconWindow(Gtk.ScrolledWindow):
 				self.selected_x = event.x
 				self.selected_y = event.y
 				path = self.icon_view.get_path_at_pos(event.x,event.y)
-				name = self.icon_store[path][1]
+				self.menu_item = self.icon_store[path][1]
 				self.icon_view.select_path(path)
-				menu = self.icon_dict[name]['menu']
-				menu.show_all()
-				menu.popup(None, None, None, None, event.button, event.time)
+				self.icon_context_menu.show_all()
+				self.icon_context_menu.popup(None, None, None, None, event.button, event.time)
 		elif event.button == Gdk.BUTTON_PRIMARY:
 			# Left-click handling code
 			path = self.icon_view.get_path_at_pos(int(event.x), int(event.y))
@@ -242,23 +248,29 @@ class IconWindow(Gtk.ScrolledWindow):
 
 		return menu
 
-	def create_icon_context_menu(self,name):
+	def _on_icon_menu(self,widget,handler):
+		''' run a handler from the icon context menu on the icon it was opened on '''
+		if self.menu_item:
+			handler(widget,self.menu_item)
+
+	def create_icon_context_menu(self):
+		''' the context menu for icons, one shared by all of them '''
 		detail_text = "Open Detail Window"
 		show_item = None
 		menu = Gtk.Menu()
 		chart_item = Gtk.MenuItem(label="Show Chart")
-		chart_item.connect('activate',self.on_show_chart,name)
+		chart_item.connect('activate',self._on_icon_menu,self.on_show_chart)
 		edit_item = Gtk.MenuItem(label="Edit")
 		remove_item = Gtk.MenuItem(label="Remove")
-		edit_item.connect("activate", self.on_icon_edit_activate, name)
-		remove_item.connect("activate", self.on_icon_remove_activate, name)
+		edit_item.connect("activate", self._on_icon_menu, self.on_icon_edit_activate)
+		remove_item.connect("activate", self._on_icon_menu, self.on_icon_remove_activate)
 
 		detail_item = Gtk.MenuItem('Show detail window')
-		detail_item.connect('activate',self.on_icon_detail_activate, name)
+		detail_item.connect('activate',self._on_icon_menu, self.on_icon_detail_activate)
 		sort_item, sort_submenu = self._sort_menu()
 		if self.info_menu:
 			info_item = Gtk.MenuItem(label="Get Info")
-			info_item.connect('activate',self.on_info_item_activate, name)
+			info_item.connect('activate',self._on_icon_menu, self.on_info_item_activate)
 			menu.append(info_item)
 		menu.append(edit_item)
 		menu.append(remove_item)
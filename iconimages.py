@@ -1,47 +1,177 @@
+'''
+Icon images for the icon views.
+Each icon has four states: 0 is the image as it is, 1 to 3 are the image
+scaled to 64x64 with the active_badge, active_chart or active_both badge
+from the icon's directory laid over it. The images come from a process wide
+IconCache keyed by (path, mtime, size, state), so an icon file is decoded
+once however often the views are rebuilt, a state is only composited when
+it is first shown and an edited file is picked up because its key changes.
+The badges are loaded once. The least recently used images are dropped
+when there are more than max_images. Given a cache_dir the composited
+images are also kept on disk and reused by the next run.
+'''
 import os
+import hashlib
+import threading
+from collections import OrderedDict
 import gi
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk, Gdk, GdkPixbuf
 
-def get_icon_images(source_image_path):
+from dflib.debug import debug
+from dflib.snapshot import write_atomic
+
+icon_size = 64
+badges = ['badge','chart','both']
+''' the badge for each active state, state n uses badges[n-1] '''
+
+class IconImages:
+	'''
+	The images of one icon as a sequence indexed by state, each made when
+	it is first asked for.
+	'''
+	def __init__(self,path,cache=None):
+		self.path = path
+		self.cache = cache or get_icon_cache()
+
+	def __len__(self):
+		return len(badges) + 1
+
+	def __getitem__(self,state):
+		if not 0 <= state < len(self):
+			raise IndexError(state)
+		return self.cache.get(self.path,state)
+
+class IconCache:
 	'''
-	Create a suitable icon from a file for both regular and acive by 
-	applying an image with the active badge to the source. Return both GdkPixbufs
+	Pixbufs of icons by state. get(path, state) returns the image, making
+	it from the file the first time.
 	'''
+	def __init__(self,max_images=512,cache_dir=None):
+		self.max_images = max_images
+		self.cache_dir = cache_dir
+		self._images = OrderedDict()
+		self._badges = {}
+		self._lock = threading.Lock()
+		self.stats = {
+			'hits': 0,
+			'decoded': 0,
+			'composited': 0,
+			'disk_hits': 0,
+		}
+		if cache_dir:
+			os.makedirs(cache_dir,exist_ok=True)
+
+	def _key(self,path,state):
+		st = os.stat(path)
+		return (os.path.abspath(path),st.st_mtime_ns,st.st_size,state)
+
+	def get(self,path,state=0):
+		''' the image of path in state '''
+		key = self._key(path,state)
+		with self._lock:
+			image = self._images.get(key)
+			if image is not None:
+				self._images.move_to_end(key)
+				self.stats['hits'] += 1
+				return image
+		if state == 0:
+			image = GdkPixbuf.Pixbuf.new_from_file(path)
+			self.stats['decoded'] += 1
+		else:
+			image = self._from_disk(key)
+			if image is None:
+				image = self._composite(path,state)
+				self._to_disk(key,image)
+		self._store(key,image)
+		return image
+
+	def _store(self,key,image):
+		with self._lock:
+			self._images[key] = image
+			while len(self._images) > self.max_images:
+				self._images.popitem(last=False)
+
+	def _scaled(self,path):
+		''' the source scaled to icon_size, cached as state -1 '''
+		key = self._key(path,-1)
+		with self._lock:
+			image = self._images.get(key)
+		if image is None:
+			image = self.get(path,0).scale_simple(icon_size,icon_size,GdkPixbuf.InterpType.BILINEAR)
+			self._store(key,image)
+		return image
 
-	source_image = GdkPixbuf.Pixbuf.new_from_file(source_image_path)
-	image_list = [source_image]
-	for active in ['badge','chart','both']:
-		ipath = os.path.join(os.path.dirname(source_image_path),f"active_{active}.png")
-		image2 = GdkPixbuf.Pixbuf.new_from_file(ipath)
-
-		# Scale source_image to the desired dimensions
-		scaled_source_image = source_image.scale_simple(64, 64, GdkPixbuf.InterpType.BILINEAR)
-
-		# Create a new transparent image to composite onto
-		composite_image = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8, 64, 64)
-		composite_image.fill(0x000000)  # Fill with black
-
-		# Draw scaled_source_image onto the composite image
-		scaled_source_image.copy_area(0, 0, 64, 64, composite_image, 0, 0)
-
-		# Calculate position to center image2 on composite_image
-		x_offset = (64 - image2.get_width()) // 2
-		y_offset = (64 - image2.get_height()) // 2
-
-		# Draw image2 onto the composite image
-		image2.composite(
-			composite_image,
-			x_offset,
-			y_offset,
-			image2.get_width(),
-			image2.get_height(),
-			x_offset,
-			y_offset,
-			1,
-			1,
-			GdkPixbuf.InterpType.BILINEAR,
-			255,
-		)
-		image_list.append(composite_image)
-	return (image_list)
\ No newline at end of file
+	def badge(self,directory,state):
+		''' the badge for state from directory, loaded once '''
+		path = os.path.join(directory,f'active_{badges[state-1]}.png')
+		image = self._badges.get(path)
+		if image is None:
+			image = GdkPixbuf.Pixbuf.new_from_file(path)
+			self._badges[path] = image
+		return image
+
+	def _composite(self,path,state):
+		''' the scaled source with the badge for state centred on it '''
+		badge = self.badge(os.path.dirname(path),state)
+		image = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB,True,8,icon_size,icon_size)
+		image.fill(0x000000)
+		self._scaled(path).copy_area(0,0,icon_size,icon_size,image,0,0)
+		width = badge.get_width()
+		height = badge.get_height()
+		x_offset = (icon_size - width) // 2
+		y_offset = (icon_size - height) // 2
+		badge.composite(image,x_offset,y_offset,width,height,
+			x_offset,y_offset,1,1,GdkPixbuf.InterpType.BILINEAR,255)
+		self.stats['composited'] += 1
+		return image
+
+	def _disk_path(self,key):
+		name = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+		return os.path.join(self.cache_dir,f'{name}.png')
+
+	def _from_disk(self,key):
+		if not self.cache_dir:
+			return None
+		path = self._disk_path(key)
+		if not os.path.exists(path):
+			return None
+		try:
+			image = GdkPixbuf.Pixbuf.new_from_file(path)
+		except Exception as e:
+			debug(f'bad cached icon {path}: {e}')
+			return None
+		self.stats['disk_hits'] += 1
+		return image
+
+	def _to_disk(self,key,image):
+		if not self.cache_dir:
+			return
+		try:
+			ok, payload = image.save_to_bufferv('png',[],[])
+			if ok:
+				write_atomic(self._disk_path(key),payload)
+		except Exception as e:
+			debug(f'could not cache icon {key[0]}: {e}')
+
+	def clear(self):
+		''' forget every image, the badges too '''
+		with self._lock:
+			self._images.clear()
+		self._badges.clear()
+
+_icon_cache = None
+
+def get_icon_cache(**kwargs):
+	''' the process wide IconCache, created with kwargs on first use '''
+	global _icon_cache
+	if not _icon_cache:
+		_icon_cache = IconCache(**kwargs)
+	return _icon_cache
+
+def get_icon_images(source_image_path):
+	'''
+	The images of an icon, regular and with each of the active badges, as
+	a sequence indexed by state. Each state is made when first used.
+	'''
+	return IconImages(source_image_path)
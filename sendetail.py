@@ -18,7 +18,9 @@ if os.uname()[0] == 'Darwin':
 else:
 	data_path = '/sensor'
 
-from dflib import widgets, rest, psen
+from dflib import widgets, rest
+from dflib.bgio import get_bgio
+from sensorhub import SensorHub
 from dflib.debug import debug
 
 ''' Colors for dark mode '''
@@ -54,7 +56,9 @@ light_mode_colors = {
 class SenDetail(Gtk.Window):
 	'''
 	This class implements the sensor detail window. 
-	The specified sensor is read every config['poll_interval'] seconds.
+	The window listens to the SensorHub for new readings of the specified 
+	sensor, or reads it every config['poll_interval'] miliseconds when the
+	RestAPI is used directly.
 	When the window is created it is positioned based on the position 
 	parameter. Window movement is tracked and reported to the caller. 
 	The keyword arguments for this class are:
@@ -79,6 +83,9 @@ class SenDetail(Gtk.Window):
 		self._initial_position_set = False
 		self.iconified = False
 		self._data_thread = None
+		self._hub_token = None
+		self._poll_timer = None
+		self.sensor = None
 		self.data_path = data_path
 		for k,v in kwargs.items():
 			if k in ['config','host','sensor_name','title','callback','position','move_callback','data_path']:
@@ -100,14 +107,9 @@ class SenDetail(Gtk.Window):
 		self.server = self.config['server']
 		if self._use_rest:
 			self.sensor = rest.RestClient(server=self.server,sensor=self.sensor_name,host=self.host)
-		else:
-			self.sensor = psen.PsuedoSensor(
-				base_path = self.data_path,
-				server=self.server,
-				sensor=self.sensor_name,
-				host=self.host)
 		Gtk.Window.__init__(self, title=self.title)
 		self.connect("delete-event", self.stopit)
+		self.connect("destroy", self.on_destroy)
 		self.keepgoing = True
 		self.vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
 		self.label = Gtk.Label()
@@ -118,8 +120,53 @@ class SenDetail(Gtk.Window):
 		window_icon = GdkPixbuf.Pixbuf.new_from_file('icons/humidity.png')
 		self.set_icon(window_icon)
 		self.show_all()
+		self._watch()
 		self.update()
 
+	def _watch(self):
+		'''
+		refresh on each new reading from the hub, or poll every 
+		poll_interval when reading the RestAPI directly.
+		'''
+		self._unwatch()
+		if self._use_rest:
+			self._poll()
+			self._poll_timer = GLib.timeout_add(self.config['poll_interval'],self._poll)
+		else:
+			self._hub_token = SensorHub.get().subscribe(
+				self.host,
+				self.sensor_name,
+				self.on_reading,
+				self.data_path)
+
+	def _unwatch(self):
+		''' stop listening to or polling the sensor '''
+		if self._hub_token:
+			SensorHub.get().unsubscribe(self._hub_token)
+			self._hub_token = None
+		if self._poll_timer:
+			GLib.source_remove(self._poll_timer)
+			self._poll_timer = None
+
+	def on_destroy(self,*args):
+		''' however we are destroyed, stop reading the sensor '''
+		self.keepgoing = False
+		self._unwatch()
+		get_bgio().cancel_owner(self)
+
+	def on_reading(self,detail):
+		''' there is a new reading for us '''
+		if self.keepgoing and detail:
+			self.update(detail)
+
+	def _poll(self):
+		''' read the RestAPI in the background, the reading arrives in on_reading '''
+		if not self.keepgoing:
+			self._poll_timer = None
+			return False
+		get_bgio().submit(self.read_sensor,callback=self.on_reading,owner=self)
+		return True
+
 	def change_sensor(self, title, host, sensor):
 		'''
 		Change title,host and sensor used.
@@ -129,8 +176,10 @@ class SenDetail(Gtk.Window):
 		self.host = host
 		self.sensor_name = sensor
 		self.server = self.config['server']
-		self.sensor = rest.RestClient(server=self.server,sensor=self.sensor_name,host=self.host)
+		if self._use_rest:
+			self.sensor = rest.RestClient(server=self.server,sensor=self.sensor_name,host=self.host)
 		debug(self.server,title, host, sensor)
+		self._watch()
 
 	def do_iconify(self,*args):
 		'''
@@ -193,6 +242,7 @@ class SenDetail(Gtk.Window):
 		'''
 		debug(f'stopit; {self.title}')
 		self.keepgoing = False
+		self._unwatch()
 		if callable(self.callback):
 			self.callback(self.title)
 		self.destroy()
@@ -200,8 +250,11 @@ class SenDetail(Gtk.Window):
 	def read_sensor(self):
 		''' reas the sensor and return data unless there's an error in the data
 		'''
-		we = f'{self.sensor.host}::{self.sensor.sensor}'
-		detail = self.sensor.read()
+		we = f'{self.host}::{self.sensor_name}'
+		if self._use_rest:
+			detail = self.sensor.read()
+		else:
+			detail = SensorHub.get().last(self.host,self.sensor_name)
 		if type(detail) is dict:
 			if 'error' in detail:
 				return None
@@ -211,13 +264,12 @@ class SenDetail(Gtk.Window):
 		return detail
 
 
-	def update(self):
+	def update(self,detail=None):
 		'''
 		This is out main worker.
 		First we check for dark_mode and set css accordingly. 
-		We read the sensor and if data is returned format it 
-		based on keys and colors. Once complete set a new timeout 
-		to do this all over again.
+		If no reading is passed in we take the hub's latest. If there is
+		data format it based on keys and colors.
 		'''
 		if 'dark_mode' not in self.config:
 			self.dark_mode = False
@@ -236,7 +288,8 @@ class SenDetail(Gtk.Window):
 		widgets._widget_set_css(self.label, 'sdetail', css_data)
 		key_color = self.key_color
 		dark_mode = self.dark_mode
-		detail = self.read_sensor()
+		if detail is None and not self._use_rest:
+			detail = self.read_sensor()
 		if detail and not 'error' in detail:
 			detail['name'] = self.sensor_name
 			s = ''
@@ -279,7 +332,3 @@ class SenDetail(Gtk.Window):
 
 		if not self._initial_position_set:
 			self.set_window_position()
-
-		if self.keepgoing:
-			interval = self.config['poll_interval']
-			GLib.timeout_add(interval, self.update)
@@ -18,6 +18,7 @@ from iconbox import IconWindow
 from dflib import widgets
 from dflib.debug import debug, dpprint, set_debug
 from dflib import rest, theme
+from dflib.bgio import get_bgio
 import chartconf
 import copy
 import defaults
@@ -35,7 +36,7 @@ class SensorInfo:
 		r = rest.RestClient(server=self.server,host='none',sensor='none')
 		hlist = r.hosts()
 		for host in hlist:
-			r = rest.RestClient(server=self.server,host=host,sensor='none')
+			r.setup(host=host)
 			self.hosts[host] = r.list()
 			self.hosts[host].sort()
 
@@ -127,7 +128,7 @@ class SensorEditor(Gtk.Window):
 		if not 'chart' in self.sensor:
 			self.sensor['chart'] = defaults.chart
 
-		self.si = SensorInfo(self.config['server'])
+		self.si = None
 		if 'key' in self.sensor['chart']:
 			key = self.sensor['chart']['key']
 		else:
@@ -135,18 +136,43 @@ class SensorEditor(Gtk.Window):
 			key = sc.get_sensor_keys()[0]
 		self.sensor['chart']['key'] = key
 		self.connect('delete-event',self.on_wm_delete_event)
+		self.connect('destroy',self.on_destroy)
+		self.loading = Gtk.Label(label=f"Getting sensors from {self.config['server']}...")
+		widgets._widget_set_css(self.loading,'loading','.loading {padding: 20px}')
+		self.add(self.loading)
+		self.show_all()
+		get_bgio().submit(
+			SensorInfo,
+			self.config['server'],
+			callback=self._build,
+			on_error=self.on_sensor_info_error,
+			owner=self)
+
+	def on_destroy(self,*args):
+		''' drop the host walk if it is still going '''
+		get_bgio().cancel_owner(self)
+
+	def on_sensor_info_error(self,exception):
+		debug(f'cannot get sensors: {exception}')
+		self.loading.set_text(f"Cannot get sensors from {self.config['server']}")
+
+	def _build(self,si):
+		'''
+		build the editor once SensorInfo has walked the hosts
+		'''
+		self.si = si
 		self.hosts = self.si.sensor_hosts()
 
 		if self.name:
 			self.host = self.sensor['host']
 			self.sendev = self.sensor['sensor']
 			imgpath = os.path.join(self.prog_dir,self.sensor['icon'])
+			self.sensors = self.si.sensors_on_host(self.host)
 		else:
 			imgpath = os.path.join(self.prog_dir,'icons/select.png')
 			self.host = self.hosts[0]
-			self.sendev = self.sensors[self.host][0]
-
-		self.sensors = self.si.sensors_on_host(self.host)
+			self.sensors = self.si.sensors_on_host(self.host)
+			self.sendev = self.sensors[0]
 
 		img =  Gtk.Image.new_from_file(imgpath)
 		img.set_size_request(64, 64)
@@ -221,6 +247,7 @@ class SensorEditor(Gtk.Window):
 		debug("setting values:",self.host,self.sendev)
 		self.host_select.set_value(self.host)
 		self.sen_select.set_value(self.sendev)
+		self.remove(self.loading)
 		self.add(box)
 		self.show_all()
 
@@ -281,6 +308,8 @@ class SensorEditor(Gtk.Window):
 		'''
 		if the close button is clicked check to save changes
 		'''
+		if not self.si:
+			return False
 		if widgets.yesno(self,'Save any changes and Close?') == 'yes':
 			self.on_ok_clicked()
 			return False
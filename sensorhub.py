@@ -0,0 +1,141 @@
+'''
+The sensor data bus for the GUI.
+There is one SensorHub in the program. It keeps one reader per (host, sensor)
+however many windows show that sensor, watches the sensor's data once and,
+when it changes, reads it once on a background worker and hands the reading
+to every listener on the Gtk main loop. Listeners are detail windows, charts
+and anything else that wants readings. Changes are handed from the watcher
+thread to the main loop, so the feeds are only touched there; a change that
+arrives while a read is outstanding marks the feed dirty and it is read
+again when that read is done.
+'''
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import GLib
+
+from dflib import psen, watch
+from dflib.bgio import get_bgio
+from dflib.debug import debug
+
+class SensorHub:
+	'''
+	Use SensorHub.get() to get the hub.
+	subscribe(host, sensor, listener, data_path) calls listener(reading) with
+	a copy of each new reading and returns a token for unsubscribe.
+	'''
+	_instance = None
+
+	@classmethod
+	def get(cls):
+		''' the program's hub '''
+		if not cls._instance:
+			cls._instance = cls()
+		return cls._instance
+
+	def __init__(self):
+		self._feeds = {}
+		self._tokens = {}
+		self._next_token = 1
+		self.stats = {
+			'reads': 0,
+			'published': 0
+		}
+
+	def subscribe(self,host,sensor,listener,data_path):
+		''' call listener(reading) on each new reading of host/sensor '''
+		key = (host,sensor)
+		feed = self._feeds.get(key)
+		if not feed:
+			feed = {
+				'reader': psen.PsuedoSensor(base_path=data_path,host=host,sensor=sensor),
+				'listeners': {},
+				'last': None,
+				'pending': False,
+				'dirty': False,
+			}
+			feed['watch'] = watch.get_watcher().subscribe(
+				feed['reader'].path(),
+				lambda path, key=key: GLib.idle_add(self._changed,key))
+			self._feeds[key] = feed
+			debug(f'new feed for {host}/{sensor}')
+			self._changed(key)
+		token = self._next_token
+		self._next_token += 1
+		feed['listeners'][token] = listener
+		self._tokens[token] = key
+		return token
+
+	def unsubscribe(self,token):
+		''' stop calling the listener subscribed with token '''
+		key = self._tokens.pop(token,None)
+		if not key:
+			return
+		feed = self._feeds[key]
+		del feed['listeners'][token]
+		if not feed['listeners']:
+			watch.get_watcher().unsubscribe(feed['watch'])
+			del self._feeds[key]
+			debug(f'dropped feed for {key[0]}/{key[1]}')
+
+	def last(self,host,sensor):
+		'''
+		a copy of the latest reading for host/sensor, None until the first 
+		reading has been published
+		'''
+		feed = self._feeds.get((host,sensor))
+		if not feed or feed['last'] is None:
+			return None
+		return dict(feed['last'])
+
+	def _changed(self,key):
+		'''
+		read the sensor in the background. If a read is outstanding the feed
+		is marked dirty and read once more when it finishes. Runs on the
+		main loop.
+		'''
+		feed = self._feeds.get(key)
+		if not feed:
+			return False
+		if feed['pending']:
+			feed['dirty'] = True
+		else:
+			feed['pending'] = True
+			feed['dirty'] = False
+			self.stats['reads'] += 1
+			get_bgio().submit(
+				feed['reader'].read,
+				callback=lambda data, key=key: self._publish(key,data),
+				on_error=lambda e, key=key: self._failed(key,e))
+		return False
+
+	def _done(self,feed,key):
+		''' a read has finished, start another if it changed meanwhile '''
+		feed['pending'] = False
+		if feed['dirty']:
+			self._changed(key)
+
+	def _failed(self,key,exception):
+		debug(f'reading {key[0]}/{key[1]} failed: {exception}')
+		feed = self._feeds.get(key)
+		if feed:
+			self._done(feed,key)
+
+	def _publish(self,key,data):
+		''' runs on the main loop with a new reading '''
+		feed = self._feeds.get(key)
+		if not feed:
+			return
+		self._done(feed,key)
+		if type(data) is dict and not 'error' in data:
+			feed['last'] = data
+			for listener in list(feed['listeners'].values()):
+				self.stats['published'] += 1
+				listener(dict(data))
+
+	def sensor_count(self):
+		''' number of distinct sensors being read '''
+		return len(self._feeds)
+
+	def listener_count(self):
+		''' number of listeners across all sensors '''
+		return len(self._tokens)
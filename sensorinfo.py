@@ -9,15 +9,20 @@ from dflib import rest
 #set_debug(True)
 
 class Sensor:
-	def __init__(self,server,host,sensor):
+	def __init__(self,server,host,sensor,data=None):
 		self.client = rest.RestClient(server=server, host=host, sensor=sensor)
 		self.modinfo = ''
 		self.description = ''
 		self._name = sensor
-		self.read()
+		if data:
+			self._set_data(data)
+		else:
+			self.read()
 
 	def read(self):
-		data = self.client.read()
+		return self._set_data(self.client.read())
+
+	def _set_data(self,data):
 		if not 'error' in data:
 			self.data  = data
 			if 'modinfo' in data:
@@ -36,10 +41,12 @@ class SensorHost:
 		self.host = host
 		self.sensors = {}
 		debug(self.server,self.host)
-		sens = rest.RestClient(server=self.server, host=self.host,sensor=None).list()
+		client = rest.RestClient(server=self.server, host=self.host,sensor=None)
+		sens = client.list()
+		data = client.read_many([(self.host,sen) for sen in sens])
 		for sen in sens:
 			debug(self.server,self.host,sen)
-			self.sensors[sen] = Sensor(self.server,self.host,sen)
+			self.sensors[sen] = Sensor(self.server,self.host,sen,data[(self.host,sen)])
 			
 	def list(self):
 		return self.sensors.keys()
@@ -21,8 +21,9 @@ sys.path.append(os.path.expanduser('~/lib'))
 sys.path.append(prog_dir)
 os.chdir(prog_dir)
 
-from dflib import widgets, rest
+from dflib import widgets, rest, psen, watch
 from dflib.theme import change_theme
+from dflib.bgio import get_bgio
 from dflib.debug import debug, set_debug, dpprint, set_log_file
 import sensoredit
 from sendetail import SenDetail
@@ -33,6 +34,7 @@ import chartwin
 import chartconf
 import sencaps
 import cfg
+import iconimages
 
 program_version="3.0.1b (05 May 2024)"
 pid_file = '/tmp/.sensors'
@@ -62,6 +64,9 @@ class Sensors(Gtk.ApplicationWindow):
 		if sys.platform == 'linux' and not 'GNOME_SESSION_ID' in os.environ:
 			self.use_toolbar = True
 		self.config = cfg.get_config()
+		watch.get_watcher(interval=self.config['poll_interval']/1000)
+		# icon_cache is a directory to keep composited icons in between runs
+		iconimages.get_icon_cache(cache_dir=self.config.get('icon_cache'))
 		Gtk.ApplicationWindow.__init__(self,title=f"Sensors {program_version}")
 		self.actives = {}
 		self.charts = {}
@@ -71,8 +76,6 @@ class Sensors(Gtk.ApplicationWindow):
 
 		self.icon_dict = {}
 		for s, d in self.config['sensors'].items():
-			if s.startswith('::'):
-				continue
 			icon = d['icon'] 
 			itype = d['sensor']
 			self.icon_dict[s] = {"name": s, "icon": os.path.join(prog_dir,icon), "type": itype}
@@ -150,16 +153,13 @@ class Sensors(Gtk.ApplicationWindow):
 
 	def open_previous_windows(self):
 		''' open any previous windows based on active flag in config '''
-		if '::main::' in self.config['sensors']:
-			debug('moving main')
-			if 'size' in self.config['sensors']['::main::']:
-				size = self.config['sensors']['::main::']['size']
-				self.set_default_size(*size)
-				self.resize(*size)
-			self.move(*self.config['sensors']['::main::']['pos'])
+		main = cfg.window_state('main')
+		debug('moving main')
+		if main.size:
+			self.set_default_size(*main.size)
+			self.resize(*main.size)
+		self.move(*main.pos)
 		for name,sensdef in self.config['sensors'].items():
-			if name.startswith('::'):
-				continue
 			if sensdef['active']:
 				self.open_detail_window(name)
 			if 'chart' in sensdef:
@@ -171,19 +171,18 @@ class Sensors(Gtk.ApplicationWindow):
 		return False
 
 	def save_config(self):
+		''' save window and chart state, the sensor definitions are left alone '''
 		debug()
-		cfg.write_config()
+		cfg.save_session()
 
 	def on_configure_event(self, widget, event):
 		''' when the window is moved, save the position '''
+		main = cfg.window_state('main')
 		current_size = tuple(self.get_size())
-		if self.config['sensors']['::main::']['size'] != current_size:
-			resized = True
-		else:
-			resized = False
-		self.config['sensors']['::main::']['pos'] = tuple(self.get_position())
-		self.config['sensors']['::main::']['size'] = tuple(self.get_size())
-		self.save_config()
+		resized = main.size != current_size
+		main.pos = self.get_position()
+		main.size = current_size
+		cfg.save_session()
 		if resized:
 			GLib.timeout_add(250,self.fixup_after_resize)
 
@@ -317,7 +316,7 @@ class Sensors(Gtk.ApplicationWindow):
 		self.config['sensors'][name] = copy.deepcopy(sensor)
 		host = sensor['host']
 		sendev =sensor['sensor']
-		self.save_config()
+		cfg.write_config()
 		n_in_chart = name_in in self.charts
 		n_in_active = name_in in self.actives
 		if n_in_active:
@@ -345,7 +344,7 @@ class Sensors(Gtk.ApplicationWindow):
 
 		if name_in != name or sensor_in['icon'] != sensor['icon']:
 			self.icon_window.update_icon(name_in,name,self.config['sensors'][name]['icon'])
-		self.save_config()
+		cfg.write_config()
 		debug(f'new config for {name}: {self.config["sensors"][name]}')
 
 	def open_detail_window(self, name):
@@ -382,8 +381,8 @@ class Sensors(Gtk.ApplicationWindow):
 
 	def on_detail_move(self,name,position):
 		''' this callback is called when the detail window is moved '''
-		self.config['sensors'][name]['pos'] = position
-		self.save_config()
+		cfg.sensor_state(name).pos = position
+		cfg.save_session()
 
 	def activate_event(self,item):
 		''' when an icon is clicked (activated) this 
@@ -421,7 +420,7 @@ class Sensors(Gtk.ApplicationWindow):
 
 	def on_config_done(self,*args):
 		''' callback for when program configuration is complete '''
-		self.save_config()
+		cfg.write_config()
 
 	def about(self,item):
 		''' open about box '''
@@ -430,15 +429,16 @@ class Sensors(Gtk.ApplicationWindow):
 			self.config,
 			os.path.join(prog_dir,'icons','humidity.png'),
 			program_version,
-	#		self.config['sensors']['::about::']['pos'],
-			['::main::'],
+			cfg.window_state('main').pos,
 			self.about_moved,
 			)
 
 	def about_moved(self,position):
 		''' callback for hwen aboutbox is moved '''
-		self.config['sensors']['::about::']['active'] = False
-		self.config['sensors']['::about::']['pos'] = position
+		about = cfg.window_state('about')
+		about.active = False
+		about.pos = position
+		cfg.save_session()
 
 	def remove_sensor(self,item):
 		''' remove sensor if confirmed '''
@@ -453,7 +453,7 @@ class Sensors(Gtk.ApplicationWindow):
 				self.actives[item].destroy()
 				del self.actives[item]
 			del self.config['sensors'][item]
-			self.save_config()
+			cfg.write_config()
 
 
 	def add_sensor(self,*args):
@@ -465,7 +465,7 @@ class Sensors(Gtk.ApplicationWindow):
 		definition['pos'] = (0,0)
 		definition['active'] = False
 		self.config['sensors'][name] = definition
-		self.save_config()
+		cfg.write_config()
 		self.icon_window.add_icon(definition['icon'],name)
 		debug(name,definition)
 
@@ -473,20 +473,31 @@ class Sensors(Gtk.ApplicationWindow):
 		'''
 		When the window is closed perform a little cleanup
 		'''
+		cfg.flush()
+		get_bgio().shutdown()
 		if os.path.exists(pid_file):
 			os.unlink(pid_file)
 
 	def get_info(self,item):
 		'''
-		when the get_info icon menu is clicked we build up a 
-		list of tuples. Each tuple is of label, data. 
-		This list is used to create and InfoWindow
+		when the get_info icon menu is clicked we read the sensor in 
+		the background and show the InfoWindow when the data arrives
 		'''
 		sensor = self.config['sensors'][item]
 		server = self.config['server']
 		sensor_name = sensor['sensor']
 		sensor_host = sensor['host']
-		sdata = rest.RestClient(server=server,host=sensor_host,sensor=sensor_name).read()
+		client = rest.RestClient(server=server,host=sensor_host,sensor=sensor_name)
+		get_bgio().submit(client.read,callback=lambda sdata: self.show_info(item,sdata),owner=self)
+
+	def show_info(self,item,sdata):
+		'''
+		build up a list of tuples. Each tuple is of label, data. 
+		This list is used to create and InfoWindow
+		'''
+		if not item in self.config['sensors']:
+			return
+		sensor = self.config['sensors'][item]
 		info = [
 			('Sensor Host',sensor['host']),
 			('Sensor',sensor['sensor']),
@@ -706,6 +717,7 @@ if __name__ == "__main__":
 	parser.add_argument('-d','--debug',action='store_true',help='turn on copious debugging messages',default=False)
 	parser.add_argument('--data-dir',type=str,default=data_path, metavar='path', help='path for sensor data')
 	parser.add_argument('--run-dir',type=str,default=prog_dir,metavar='path',help='Set runtime path')
+	parser.add_argument('--shm',type=str,default=None,metavar='file',help='read sensor data from the collector\'s snapshot store')
 	parser.add_argument('-l','--logfile',type=str,metavar='file',default=False, help='send debug messages to file')
 	args = parser.parse_args()
 	data_path = args.data_dir
@@ -719,6 +731,8 @@ if __name__ == "__main__":
 		set_debug(True)
 	if args.logfile:
 		set_log_file(args.logfile)
+	if args.shm and not psen.use_store(args.shm):
+		print(f"{args.shm} is not a snapshot store, reading sensor files",file=sys.stderr)
 	dark_mode = False
 	if 'dark_mode' in cfg.get_config():
 		dark_mode = cfg.get_config()['dark_mode']
@@ -0,0 +1,100 @@
+'''
+RestClient.read_many against a stand-in RestAPI server on localhost.
+'''
+import json
+import threading
+import unittest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from dflib import rest
+
+def reading(host,sensor):
+	return {'host': host, 'sensor': sensor, 'temp': 21.5}
+
+class Handler(BaseHTTPRequestHandler):
+	'''
+	read answers for any sensor. readmany depends on the server's mode:
+	'batch' answers every sensor, 'old' is a 404, 'partial' leaves out
+	sensors called missing and 'error' is a 200 with a top level error.
+	'''
+	def do_GET(self):
+		url = urlparse(self.path)
+		query = parse_qs(url.query)
+		self.server.requests.append(url.path)
+		if url.path == '/read':
+			self.reply(200,reading(query['host'][0],query['sensor'][0]))
+		elif url.path == '/readmany' and self.server.mode != 'old':
+			if self.server.mode == 'error':
+				self.reply(200,{'error': 'no such sensor'})
+				return
+			result = {}
+			for spec in query['sensors'][0].split(','):
+				host, sensor = spec.split('/')
+				if sensor != 'missing':
+					result[spec] = reading(host,sensor)
+			self.reply(200,result)
+		else:
+			self.reply(404,{'error': 'not found'})
+
+	def reply(self,status,data):
+		payload = json.dumps(data).encode('utf-8')
+		self.send_response(status)
+		self.send_header('Content-Type','application/json')
+		self.send_header('Content-Length',str(len(payload)))
+		self.end_headers()
+		self.wfile.write(payload)
+
+	def log_message(self,*args):
+		pass
+
+class ReadManyTest(unittest.TestCase):
+	pairs = [('pi4','bmp280'),('pi3','aht10')]
+
+	def setUp(self):
+		self.server = HTTPServer(('127.0.0.1',0),Handler)
+		self.server.mode = 'batch'
+		self.server.requests = []
+		threading.Thread(target=self.server.serve_forever,daemon=True).start()
+		self.old_port = rest.port
+		rest.port = self.server.server_address[1]
+		rest.batch_support.clear()
+		self.client = rest.RestClient(server='127.0.0.1',host='pi4',sensor='bmp280',
+			sessions=rest.SessionRegistry(),health=rest.HostHealth())
+
+	def tearDown(self):
+		self.client.sessions.close()
+		self.server.shutdown()
+		self.server.server_close()
+		rest.port = self.old_port
+
+	def test_batch(self):
+		result = self.client.read_many(self.pairs)
+		self.assertEqual(result,{pair: reading(*pair) for pair in self.pairs})
+		self.assertEqual(self.server.requests,['/readmany'])
+		self.assertIs(rest.batch_supported('127.0.0.1'),True)
+
+	def test_fallback(self):
+		self.server.mode = 'old'
+		result = self.client.read_many(self.pairs)
+		self.assertEqual(result,{pair: reading(*pair) for pair in self.pairs})
+		self.assertIs(rest.batch_supported('127.0.0.1'),False)
+		self.server.requests.clear()
+		self.client.read_many(self.pairs)
+		self.assertEqual(self.server.requests,['/read','/read'])
+
+	def test_partial(self):
+		self.server.mode = 'partial'
+		result = self.client.read_many(self.pairs + [('pi4','missing')])
+		self.assertEqual(result[('pi4','bmp280')],reading('pi4','bmp280'))
+		self.assertIn('error',result[('pi4','missing')])
+		self.assertIs(rest.batch_supported('127.0.0.1'),True)
+
+	def test_error_keeps_batching(self):
+		self.server.mode = 'error'
+		result = self.client.read_many(self.pairs)
+		self.assertEqual(result,{pair: reading(*pair) for pair in self.pairs})
+		self.assertIsNot(rest.batch_supported('127.0.0.1'),False)
+
+if __name__ == '__main__':
+	unittest.main()